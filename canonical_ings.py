@@ -0,0 +1,108 @@
+import os
+import sys
+import json
+from collections import Counter
+from pathlib import Path
+
+from metadata import index_dir, load_metadata
+from merge_utils import edit_dist, parse_recipe
+from lexicon import load_lexicon
+
+
+canonical_file = 'ingredients.json'
+
+
+class CanonicalTable:
+    """
+    A lookup table from ingredient names to canonical ingredient ids. Names with the same id are copies of
+    the same ingredient, so they can be merged by comparing ids instead of edit distances
+    """
+
+    def __init__(self, name_ids=None, canonical=None):
+        self.name_ids = name_ids if name_ids is not None else {}    # name -> canonical id
+        self.canonical = canonical if canonical is not None else []  # canonical id -> canonical name
+
+    def __len__(self):
+        return len(self.name_ids)
+
+    def get(self, name):
+        """
+        :return: the canonical id of the ingredient name, or None if the name isn't in the table
+        """
+        return self.name_ids.get(name)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'names': self.name_ids, 'canonical': self.canonical}, f)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'r') as f:
+            data = json.load(f)
+        return CanonicalTable(data['names'], data['canonical'])
+
+
+def cluster_names(name_counts, thresh=2):
+    """
+    Cluster ingredient names the same way MIngredient compares them: a name joins the most common canonical
+    name within edit distance thresh of it, or starts a new cluster
+    :param name_counts: a Counter of the ingredient names
+    :param thresh: the maximal edit distance between copies of the same ingredient
+    :return: a CanonicalTable object
+    """
+    table = CanonicalTable()
+    by_length = {}  # the canonical ids of each name length, only these lengths can be within the threshold
+    for name, _ in sorted(name_counts.items(), key=lambda x: (-x[1], x[0])):
+        cid = None
+        cands = sorted(c for length in range(len(name) - thresh, len(name) + thresh + 1)
+                       for c in by_length.get(length, []))
+        for c in cands:  # the ids are given by frequency, so the most common name is checked first
+            if edit_dist(name, table.canonical[c], thresh) <= thresh:
+                cid = c
+                break
+        if cid is None:
+            cid = len(table.canonical)
+            table.canonical.append(name)
+            by_length.setdefault(len(name), []).append(cid)
+        table.name_ids[name] = cid
+    return table
+
+
+def build_canonical_table(recipes, thresh=2, lexicon=None):
+    """
+    Parse the given recipes and cluster the names of their ingredients. This is an offline pass, as it parses
+    every recipe
+    :param recipes: an iterable of normalized recipes (e.g. RecipeMetadata.iter_recipes())
+    :param thresh: the maximal edit distance between copies of the same ingredient
+    :param lexicon: the Lexicon of the lite NLP backend (see lexicon.py), None for the full backend
+    :return: a CanonicalTable object
+    """
+    name_counts = Counter()
+    for recipe in recipes:
+        _, _, rec_ings = parse_recipe(recipe, lexicon=lexicon)
+        name_counts.update(ing.name for ing in rec_ings)
+    return cluster_names(name_counts, thresh)
+
+
+def load_canonical_table(json_path):
+    """
+    :param json_path: the directory where the downloaded recipes are found
+    :return: the saved CanonicalTable of the recipes, or None if it wasn't built
+    """
+    path = index_dir(json_path) / canonical_file
+    return CanonicalTable.load(path) if path.exists() else None
+
+
+def main():
+    json_path = Path(os.path.dirname(os.path.realpath(__file__)) + '/jsons/')
+    lexicon = load_lexicon(json_path) if '--lite' in sys.argv else None
+    if '--lite' in sys.argv and lexicon is None:
+        print('No lexicon was built (run lexicon.py), using the full NLP backend.')
+    print('Parsing all of the recipes (might take a while)...')
+    table = build_canonical_table(load_metadata(json_path).iter_recipes(), lexicon=lexicon)
+    table.save(index_dir(json_path) / canonical_file)
+    print('Found ' + str(len(table.canonical)) + ' ingredients under ' + str(len(table)) + ' names.')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+from pathlib import Path
+from collections import Counter
+
+import numpy as np
+
+from loader import num_workers
+from recipe_ir import load_ir_cache
+from canonical_ings import load_canonical_table
+from dedup import load_duplicate_index
+from lexicon import load_lexicon
+
+
+default_out_dir = './graphs/'
+
+
+class PipelineContext:
+    """
+    The state of a single query through the pipeline: its random state, NLP backend, the caches and tables it
+    reads, the number of threads reading its recipes, the directory its graphs are written to and the statistics
+    of its directions prefilter. The NLP models and the tf-idf vocabulary are loaded once per process and only
+    read, so they are shared by all of the contexts. Concurrent queries (e.g. in a thread pool) should each have
+    their own context, which can be forked from a shared one
+    """
+
+    def __init__(self, out_dir=default_out_dir, seed=None, cache=None, canonical=None, duplicates=None,
+                 workers=num_workers, lexicon=None):
+        """
+        :param out_dir: the directory the graphs are written to
+        :param seed: the seed of the context's random state, None for a random seed
+        :param cache: an IRCache of the parsed recipes, if the parsing should be cached
+        :param canonical: a CanonicalTable of the ingredient names, if one was built
+        :param duplicates: a DuplicateIndex of the recipes, if one was built
+        :param workers: the number of threads reading the recipe files of the query
+        :param lexicon: the Lexicon of the lite NLP backend (see lexicon.py), None for the full backend
+        """
+        self.out_dir = Path(out_dir)
+        self.rng = np.random.default_rng(seed)
+        self.cache = cache
+        self.canonical = canonical
+        self.duplicates = duplicates
+        self.workers = workers
+        self.lexicon = lexicon
+        self.prefilter = Counter()  # the ingredient-direction pairs of the query that were correlated and pruned
+
+    def fork(self, out_dir=None, seed=None):
+        """
+        :param out_dir: the output directory of the new context, by default the same as this context's
+        :param seed: the seed of the new context's random state
+        :return: a context for another query, sharing this context's caches, tables and NLP backend
+        """
+        return PipelineContext(self.out_dir if out_dir is None else out_dir, seed, self.cache, self.canonical,
+                               self.duplicates, self.workers, self.lexicon)
+
+    def output_path(self, name):
+        """
+        :return: the path of an output file with the given name, in the (created if needed) output directory
+        """
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        return str(self.out_dir / name)
+
+
+def load_context(json_path, out_dir=default_out_dir, seed=None, lite=False):
+    """
+    :param json_path: the directory where the downloaded recipes are found
+    :param out_dir: the directory the graphs are written to
+    :param seed: the seed of the context's random state
+    :param lite: True for the lite NLP backend, if the lexicon of the recipes was built
+    :return: a PipelineContext with the IR cache, canonical table, near-duplicate index (and lexicon) of the
+             recipes
+    """
+    return PipelineContext(out_dir, seed, load_ir_cache(json_path), load_canonical_table(json_path),
+                           load_duplicate_index(json_path), lexicon=load_lexicon(json_path) if lite else None)
@@ -0,0 +1,194 @@
+import os
+import re
+import zlib
+import pickle
+from pathlib import Path
+
+import numpy as np
+
+from metadata import index_dir, load_metadata
+
+
+duplicate_index_file = 'duplicates.idx'
+dedup_modes = ('collapse', 'skip')
+mersenne_prime = (1 << 61) - 1  # the modulus of the MinHash permutations
+
+
+def recipe_features(recipe, shingle=3):
+    """
+    :param recipe: a normalized recipe
+    :param shingle: the number of words in each shingle of the directions
+    :return: a set of the recipe's normalized ingredient lines and the word shingles of its directions
+    """
+    features = set()
+    for ing in recipe['Ingredients']:
+        words = re.findall(r'[a-z]+', ing.lower())
+        if len(words) > 0:
+            features.add('i:' + ' '.join(words))
+    words = re.findall(r'[a-z]+', ' '.join(recipe['Directions']).lower())
+    for i in range(len(words) - shingle + 1):
+        features.add('d:' + ' '.join(words[i:i+shingle]))
+    return features
+
+
+class DuplicateIndex:
+    """
+    A MinHash/LSH index of the recipes' ingredients and directions. Every recipe gets a MinHash signature, and the
+    signatures are split into bands, so only recipes that share a whole band are compared. A recipe whose
+    estimated Jaccard similarity to an earlier recipe is at least the threshold joins that recipe's cluster
+    """
+
+    def __init__(self, num_perm=64, bands=16, threshold=0.7, seed=1):
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, 1 << 29, num_perm).astype(np.uint64)  # small enough that a*x+b doesn't overflow
+        self.b = rng.randint(0, 1 << 29, num_perm).astype(np.uint64)
+        self.bands = bands
+        self.threshold = threshold
+        self.keys = []        # the key (recipe file name) of each recipe id, None if removed
+        self.signatures = []  # the MinHash signature of each recipe id
+        self.clusters = []    # the cluster of each recipe id, the id of its first recipe
+        self.buckets = {}     # (band, band signature) -> list of recipe ids
+        self.key_to_id = {}
+
+    def __len__(self):
+        return len(self.key_to_id)
+
+    def signature(self, recipe):
+        """
+        :return: the MinHash signature of the recipe's features
+        """
+        hashes = np.array([zlib.crc32(f.encode('utf-8')) for f in recipe_features(recipe)], dtype=np.uint64)
+        if len(hashes) == 0:
+            return np.full(len(self.a), mersenne_prime, dtype=np.uint64)
+        return np.min((np.outer(hashes, self.a) + self.b) % mersenne_prime, axis=0)
+
+    def _band_keys(self, sig):
+        rows = len(sig) // self.bands
+        return [(band, sig[band*rows:(band+1)*rows].tobytes()) for band in range(self.bands)]
+
+    def query(self, recipe, sig=None):
+        """
+        :param recipe: a normalized recipe
+        :param sig: the recipe's signature, if it was already computed
+        :return: a list of (<estimated similarity>, <recipe id>) tuples of the indexed near-duplicates of the
+                 recipe, most similar first
+        """
+        sig = self.signature(recipe) if sig is None else sig
+        candidates = set()
+        for band_key in self._band_keys(sig):
+            candidates.update(self.buckets.get(band_key, ()))
+        similar = [(float(np.mean(self.signatures[rid] == sig)), rid) for rid in candidates]
+        return sorted(((s, rid) for s, rid in similar if s >= self.threshold), key=lambda x: (-x[0], x[1]))
+
+    def add(self, key, recipe):
+        """
+        Add a recipe to the index. If the key is already indexed, the old recipe is replaced
+        :param key: a unique key of the recipe (its file name)
+        :param recipe: a normalized recipe
+        :return: the cluster of the recipe
+        """
+        if key in self.key_to_id:
+            self.remove(key)
+        sig = self.signature(recipe)
+        similar = self.query(recipe, sig)
+        rid = len(self.keys)
+        self.keys.append(key)
+        self.signatures.append(sig)
+        self.clusters.append(self.clusters[similar[0][1]] if len(similar) > 0 else rid)
+        self.key_to_id[key] = rid
+        for band_key in self._band_keys(sig):
+            self.buckets.setdefault(band_key, []).append(rid)
+        return self.clusters[rid]
+
+    def remove(self, key):
+        rid = self.key_to_id.pop(key, None)
+        if rid is None:
+            return
+        for band_key in self._band_keys(self.signatures[rid]):
+            self.buckets[band_key].remove(rid)
+            if len(self.buckets[band_key]) == 0:
+                del self.buckets[band_key]
+        self.keys[rid] = None
+
+    def cluster(self, key):
+        """
+        :return: the cluster of the recipe with the given key, or None if it isn't indexed
+        """
+        rid = self.key_to_id.get(key)
+        return self.clusters[rid] if rid is not None else None
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+
+def remove_duplicates(table, duplicates, mode='collapse'):
+    """
+    Keep a single recipe of each cluster of near-duplicates in the table, the highest scored one
+    :param table: a RecipeMetadata table of the recipes
+    :param duplicates: a DuplicateIndex of the recipes. Recipes missing from it are never duplicates
+    :param mode: 'skip' to drop the other copies, or 'collapse' to also pool their ratings, reviews and made it
+            counts into the kept recipe, so its score is the score of the copies as a whole
+    :return: a table with the recipes that were kept, in their original order
+    """
+    if mode not in dedup_modes:
+        raise ValueError('unknown deduplication mode ' + str(mode) + ', should be one of ' + ', '.join(dedup_modes))
+    scores = table.scores()
+    groups = {}
+    for row, key in enumerate(table.files):
+        cluster = duplicates.cluster(key)
+        groups.setdefault(('row', row) if cluster is None else cluster, []).append(row)
+    best = {max(rows, key=lambda r: (scores[r], -r)): rows for rows in groups.values()}  # kept row -> copies
+    kept = sorted(best)
+    result = table.subset(kept)
+    if mode == 'collapse':
+        for i, row in enumerate(kept):
+            rows = best[row]
+            if len(rows) > 1:
+                reviews, ratings = table.reviews[rows], table.ratings[rows]
+                total = np.sum(reviews)
+                result.ratings[i] = np.sum(ratings * reviews) / total if total > 0 else np.mean(ratings)
+                result.reviews[i] = total
+                result.made_it[i] = np.sum(table.made_it[rows])
+    return result
+
+
+def build_duplicate_index(json_path):
+    """
+    Index all of the recipes for near-duplicates. This is an offline pass, as it reads every recipe
+    :param json_path: the directory where the downloaded recipes are found
+    :return: a DuplicateIndex object
+    """
+    meta = load_metadata(json_path)
+    duplicates = DuplicateIndex()
+    for key, recipe in zip(meta.files, meta.iter_recipes()):
+        duplicates.add(str(key), recipe)
+    return duplicates
+
+
+def load_duplicate_index(json_path):
+    """
+    :param json_path: the directory where the downloaded recipes are found
+    :return: the saved DuplicateIndex of the recipes, or None if it wasn't built
+    """
+    path = index_dir(json_path) / duplicate_index_file
+    return DuplicateIndex.load(path) if path.exists() else None
+
+
+def main():
+    json_path = Path(os.path.dirname(os.path.realpath(__file__)) + '/jsons/')
+    print('Indexing all of the recipes (might take a while)...')
+    duplicates = build_duplicate_index(json_path)
+    duplicates.save(index_dir(json_path) / duplicate_index_file)
+    num_clusters = len({duplicates.cluster(key) for key in duplicates.key_to_id})
+    print('Found ' + str(len(duplicates) - num_clusters) + ' near-duplicates of ' + str(len(duplicates)) +
+          ' recipes.')
+
+
+if __name__ == "__main__":
+    main()
@@ -2,24 +2,55 @@ import spacy
 import nltk
 import numpy as np
 
-import json
-from collections import Counter
 import re
+from functools import lru_cache
 
-tagger = spacy.load('en_core_web_sm')
-
-with open('tfidf_w_ing.json', 'r') as f:
-    tfidf = Counter(json.load(f))
+from vocab import load_vocabulary
 
 cooking_devices = ['oven', 'refrigerator', 'freezer', 'bake',
                    'refrigerate', 'freeze', 'fridge', 'cool', 'cool down']
 blacklisted_words = ['white', 'baking', 'large', 'round', 'beat', 'one']
+mask_char = '\0'  # masks found ingredients out of the directions, never matches an ingredient
+
+signature_bits = 4096  # the size of the character trigram bitsets of the prefilter
+
+tagger = spacy.load('en_core_web_sm')
+vocab = load_vocabulary('tfidf_w_ing.json', tagger, blacklisted_words)
+
+
+def ed_verbs(words, lex=None):
+    """
+    :param words: the words of an ingredient
+    :param lex: the Lexicon of the lite NLP backend (see lexicon.py), None for the full backend
+    :return: the '-ed' words that are tagged as verbs or adjectives. With the lite backend they're looked up in
+             the lexicon, unless one of them is missing from it
+    """
+    if lex is not None:
+        entries = [(w, lex.get(w)) for w in words if w[-2:] == 'ed']
+        if all(e is not None for _, e in entries):
+            return [w for w, e in entries if e[0]]
+    tags = nltk.pos_tag(words, tagset='universal')
+    return [tag[0] for tag in tags if (tag[1] == 'VERB' or tag[1] == 'ADJ') and tag[0][-2:] == 'ed']
+
+
+def tag_word(word, lex=None):
+    """
+    :param lex: the Lexicon of the lite NLP backend, None for the full backend
+    :return: a tuple of whether the word is a stop word and its lemma. With the lite backend they're looked up
+             in the lexicon, if the word is in it
+    """
+    entry = None if lex is None else lex.get(word)
+    if entry is None:
+        token = tagger(word)[0]
+        return token.is_stop, token.lemma_
+    return entry[1], entry[2]
 
 
-def ingredient_prep(ingredients):
+def ingredient_prep(ingredients, lex=None):
     """
     Extract the preparation needed for each of the ingredients, if there is one
     :param ingredients: the ingredients
+    :param lex: the Lexicon of the lite NLP backend (see lexicon.py), None for the full backend
     :return: a list <ingredients> and another list of lists of tuples
              [[(<ingredient0>, <verb0>), (<ingredient0>, <verb1>),...],[(<ingredient1>, <verb0>),...]]
              for each of the ingredients. If there is no related verb, an empty string is returned.
@@ -29,9 +60,7 @@ def ingredient_prep(ingredients):
     for ing in ingredients:
         tuples = []
         ing = ing.replace(',', '')
-        tags = nltk.pos_tag(ing.split(), tagset='universal')
-        verbs = [tag[0] for tag in tags if (tag[1] == 'VERB' or tag[1] == 'ADJ') and
-                 tag[0][-2:] == 'ed']
+        verbs = ed_verbs(ing.split(), lex)
         for v in verbs:
             ing = ing.replace(v, '')
         if ing[0] == ' ':
@@ -39,13 +68,13 @@ def ingredient_prep(ingredients):
         if ing[-1] == ' ':
             ing = ing[:-1]
         ing = ing.split()
-        if tagger(ing[0])[0].is_stop:
+        if tag_word(ing[0], lex)[0]:
             ing = ing[1:]
-        if tagger(ing[-1])[0].is_stop:
+        if tag_word(ing[-1], lex)[0]:
             ing = ing[:-1]
         ing = ' '.join(ing)
         for v in verbs:
-            tuples.append((ing, tagger(v)[0].lemma_))
+            tuples.append((ing, tag_word(v, lex)[1]))
         formatted_ingredients.append(ing)
         ing_verb_tups.append(tuples)
 
@@ -106,47 +135,128 @@ def fix_matches(corr):
     :param corr: the found correlation
     :return: the formatted match
     """
-    match = corr[1].split()
-    score = corr[0]
-    for i, word in enumerate(match):
-        if tfidf[word] == 0 or len(word) <= 2:
-            match.pop(i)
-        else:
-            tag = tagger(word)
-            tag = tag[0]
-            if tag.pos_ != 'ADJ' and word not in blacklisted_words:
-                score += tfidf[word]
-            if tag.is_stop:
-                score -= len(tag.text)
-    match = '' if len(match) == 0 else ' '.join(match)
-    return score, match
+    return vocab.score_matches([corr])[0]
+
+
+@lru_cache(maxsize=4096)
+def gram_signature(text):
+    """
+    :return: a bitset (as an int) of the hashed character trigrams of the text. Texts with disjoint signatures
+             share no trigram, so their longest common substring is 2 characters long at most
+    """
+    return sum(1 << b for b in {hash(text[i:i+3]) % signature_bits for i in range(len(text) - 2)})
+
+
+def short_correlation(str1, str2):
+    """
+    The cross correlation of strings which share no trigram. The longest common substring is then 2 characters
+    long at most, so its words are too short to be kept by fix_matches and only its length matters
+    :return: a tuple (<substring length>, '')
+    """
+    if len({str1[i:i+2] for i in range(len(str1) - 1)} & {str2[i:i+2] for i in range(len(str2) - 1)}) > 0:
+        return 2, ''
+    return int(len(set(str1) & set(str2)) > 0), ''
 
 
-def find_correlations(ing, directions):
+def find_correlations(ing, directions, stats=None):
     """
+    Directions that share no character trigram with the ingredient can't contain any of its words, so they are
+    scored without the full cross correlation (the score is the same)
     :param ing: the ingredient to find in the directions
     :param directions: the directions to use for correlation
+    :param stats: if given, a Counter of the number of ingredient-direction 'pairs' and of the 'pruned' ones,
+            which is updated
     :return: all of the matches of the correlations
     """
-    matches = []
+    pruned = 0
+    corrs = []
+    ing_signature = gram_signature(ing)
     for d in directions:
-        correlations = cross_correlate(d, ing)
-        correlations = fix_matches(correlations)
-        matches.append(correlations)
-    return matches
+        if len(d) > 0 and len(ing) > 0 and gram_signature(d) & ing_signature == 0:
+            corrs.append(short_correlation(d, ing))
+            pruned += 1
+        else:
+            corrs.append(cross_correlate(d, ing))
+    if stats is not None:
+        stats.update(pairs=len(directions), pruned=pruned)
+    return vocab.score_matches(corrs)
+
+
+def pruning_rate(stats):
+    """
+    :param stats: a Counter of the prefilter's pairs, as updated by find_correlations
+    :return: the fraction of the ingredient-direction pairs that were pruned by the prefilter
+    """
+    return stats['pruned'] / max(stats['pairs'], 1)
 
 
-def create_tuple(ind, name, step, tok_name):
+@lru_cache(maxsize=4096)
+def parse_direction(step):
+    """
+    Tag a direction. The parsed directions are cached, so each direction is tagged only once, no matter how
+    many ingredients it contains or how many recipes share it. The returned Doc is shared, so it shouldn't be
+    changed
+    :param step: a single (atomic) direction
+    :return: the spacy Doc of the direction
+    """
+    return tagger(step)
+
+
+def token_span(doc, start, end):
+    """
+    :param doc: a parsed direction
+    :param start: the index of the first character of the span in the direction
+    :param end: the index after the last character of the span in the direction
+    :return: the span of the tokens overlapping the given characters, or None if there are no such tokens
+    """
+    inds = [t.i for t in doc if t.idx < end and t.idx + len(t.text) > start]
+    if len(inds) == 0:
+        return None
+    return doc[inds[0]:inds[-1]+1]
+
+
+def mark_ingredient(masked, ind, name, ing_spans):
+    """
+    Mark all of the occurrences of an ingredient in a direction. The occurrences are masked out of the
+    direction (keeping its length, so character indices stay valid), so later ingredients won't match them
+    :param masked: the directions used for the correlations, with the marked ingredients masked out
+    :param ind: the index of the direction the ingredient was found in
+    :param name: the name of the ingredient as it was found in the direction
+    :param ing_spans: a list of lists of (<start>, <end>) character spans for each direction, the
+            ingredient's spans are added to it
+    :return: the first (<start>, <end>) span of the ingredient, or None if it wasn't found
+    """
+    if len(name) == 0:
+        return None
+    step = masked[ind]
+    spans = []
+    start = step.find(name)
+    while start != -1:
+        spans.append((start, start + len(name)))
+        step = step[:start] + mask_char * len(name) + step[start + len(name):]
+        start = step.find(name, start + len(name))
+    masked[ind] = step
+    ing_spans[ind] += spans
+    return spans[0] if len(spans) > 0 else None
+
+
+def create_tuple(ind, name, doc, span, step_spans):
     """
     Find the verb related to the ingredient in the step
     :param ind: the index of the step (this is just added to the tuple)
     :param name: the name of the ingredient
-    :param step: the directions including the ingredient
-    :param tok_name: the token the ingredient was changed into
-    :return: a ingredient (name, verb, step index, direction) tuple
+    :param doc: the parsed direction including the ingredient
+    :param span: the token span of the ingredient in the direction, or None if it wasn't found in it
+    :param step_spans: the token spans of all of the ingredients in the direction
+    :return: a ingredient (name, verb) tuple
     """
-    tags = [a for a in tagger(step)]
-    verb = [t.text for t in tags if t.pos_ == 'VERB' and t.tag_ != 'VBN' and 'ingredient' not in t.text]
+    def in_ingredient(t):
+        return any(s.start <= t.i < s.end for s in step_spans)
+
+    step = doc.text
+    verb = [t for t in doc if t.pos_ == 'VERB' and t.tag_ != 'VBN' and not in_ingredient(t)]
+    if span is not None:
+        verb = [t for t in verb if t.i < span.start]  # only verbs before the ingredient
     if len(verb) == 0:
         if 'whisk' in step:
             tup = (name, 'whisk', ind, step)
@@ -157,18 +267,7 @@ def create_tuple(ind, name, step, tok_name):
         else:
             tup = (name, 'mix', ind, step)
     else:
-        verb = [v for v in verb if v in step.split(tok_name)[0]]
-        if len(verb) == 0:
-            if 'whisk' in step:
-                tup = (name, 'whisk', ind, step)
-            elif 'beat' in step:
-                tup = (name, 'beat', ind, step)
-            elif 'combine' in step:
-                tup = (name, 'combine', ind, step)
-            else:
-                tup = (name, 'mix', ind, step)
-        else:
-            tup = (name, verb[-1], ind, step)
+        tup = (name, verb[-1].text, ind, step)
     return tup[:2]
 
 
@@ -282,53 +381,55 @@ def merge_cooking_devices(cd_tup, ret_list, ret_inds):
     return ret_list, ret_inds
 
 
-def find_verb_tuples(directions, ingredients):
+def find_verb_tuples(directions, ingredients, stats=None):
     """
-    Find the tuples of ingredients and actions used in the directions
+    Find the tuples of ingredients and actions used in the directions. Each direction is tagged at most once,
+    and the ingredients found in it are kept as token spans of its Doc
     :param directions: the recipe's directions
     :param ingredients: the ingredients that are used in the recipe
+    :param stats: if given, a Counter of the prefilter's pairs, which is updated (see find_correlations)
     :return: a list of lists for each step with and ingredient in of tuples of
              (<ingredient name, verb, direction index, full direction>)
     """
-    tok = 'ingredient'
     matches = []
     names = []
-    nums = []
     inds = []
-    d = directions
-    d = replace_ing(d, ['grease and flour'], 'grease', None)
+    first_spans = []
+    d = replace_ing(directions, ['grease and flour'], 'grease', None)
+    masked = list(d)
+    ing_spans = [[] for _ in d]
     # Find best matches for ingredients in the directions
     for i, ingredient in enumerate(ingredients):
         # ing = nltk.word_tokenize(ingredient)
-        ing_match = find_correlations(ingredient, d)
+        ing_match = find_correlations(ingredient, masked, stats)
         matches.append(ing_match)
         hits = [a[0] for a in ing_match]
         ind = np.argmax(hits)
         inds.append(ind)
         names.append(ing_match[ind][1])
-        nums.append(i)
-        d = replace_ing(d, [ing_match[ind][1]], tok + str(i), ind)
+        first_spans.append(mark_ingredient(masked, ind, ing_match[ind][1], ing_spans))
 
     # Sort the names of the ingredients by the step that they appear in
     sorted_indices = np.argsort(inds)
     names = [names[i] for i in sorted_indices]
-    nums = [nums[i] for i in sorted_indices]
+    first_spans = [first_spans[i] for i in sorted_indices]
     inds = [inds[i] for i in sorted_indices]
 
     unique_inds = np.unique(inds)
     ret_list = [[i, []] for i in unique_inds]
     ret_inds = [[] for _ in unique_inds]
-    # Replace the ingredients in the direction by a token
-    # d = replace_ing(directions, names, tok)
+
+    # Tag each of the steps with ingredients once, and annotate the ingredients as token spans
+    docs = {ind: parse_direction(d[ind]) for ind in unique_inds}
+    step_spans = {ind: [token_span(docs[ind], *sp) for sp in ing_spans[ind]] for ind in unique_inds}
+    step_spans = {ind: [sp for sp in spans if sp is not None] for ind, spans in step_spans.items()}
 
     # Find the tuples corresponding to each ingredient in the directions
     indices = [a[0] for a in ret_list]
     for i, ind in enumerate(inds):
         list_ind = indices.index(ind)
-        name = names[i]
-        step = d[ind]
-        tok_name = tok + str(nums[i])
-        tup = create_tuple(ind, name, step, tok_name)
+        span = token_span(docs[ind], *first_spans[i]) if first_spans[i] is not None else None
+        tup = create_tuple(ind, names[i], docs[ind], span, step_spans[ind])
         ret_list[list_ind][1].append(tup)
         ret_inds[list_ind].append(sorted_indices[i])
 
@@ -338,5 +439,3 @@ def find_verb_tuples(directions, ingredients):
     cd = find_cooking_devices(directions)
     ret_list, ret_inds = merge_cooking_devices(cd, ret_list, ret_inds)
     return ret_list, ret_inds
-
-
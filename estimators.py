@@ -0,0 +1,183 @@
+import numpy as np
+
+
+class WeightedMean:
+    """
+    A streaming weighted mean, keeping only the running sums
+    """
+
+    kind = 'mean'
+
+    def __init__(self):
+        self.total = 0.0  # the total weight
+        self.weighted_sum = 0.0
+        self.n = 0
+
+    def add(self, x, w=1.0):
+        self.total += w
+        self.weighted_sum += w * x
+        self.n += 1
+
+    def merge(self, other):
+        self.total += other.total
+        self.weighted_sum += other.weighted_sum
+        self.n += other.n
+
+    def result(self):
+        return self.weighted_sum / self.total if self.total != 0 else np.nan
+
+    def to_dict(self):
+        return {'kind': self.kind, 'total': self.total, 'weighted_sum': self.weighted_sum, 'n': self.n}
+
+    def load_dict(self, state):
+        self.total, self.weighted_sum, self.n = state['total'], state['weighted_sum'], state['n']
+
+
+class TDigest:
+    """
+    A weighted t-digest (merging variant). The observed values are summarized by at most O(compression)
+    weighted centroids, which are small near the tails of the distribution and large around its middle, so
+    the quantiles (and in particular the median) are estimated accurately with a fixed amount of memory
+    """
+
+    kind = 'median'
+
+    def __init__(self, compression=50):
+        self.compression = compression
+        self.means = []    # the means of the centroids, sorted
+        self.weights = []  # the weights of the centroids
+        self.total = 0.0
+        self.n = 0
+        self._buffer = []  # values not yet merged into the centroids
+
+    def add(self, x, w=1.0):
+        self.n += 1
+        if w <= 0:  # a weightless value doesn't change any quantile
+            return
+        self._buffer.append((float(x), float(w)))
+        self.total += w
+        if len(self._buffer) >= 5 * self.compression:
+            self._compress()
+
+    def merge(self, other):
+        other._compress()
+        self._buffer += zip(other.means, other.weights)
+        self.total += other.total
+        self.n += other.n
+        self._compress()
+
+    def _compress(self):
+        """
+        Merge the buffered values into the centroids. A centroid around quantile q may hold a weight of at most
+        4 * total * q * (1 - q) / compression
+        """
+        if len(self._buffer) == 0:
+            return
+        points = sorted(list(zip(self.means, self.weights)) + self._buffer)
+        self._buffer = []
+        means, weights = [], []
+        cur_m, cur_w = points[0]
+        cum = 0.0  # the weight of the centroids before the current one
+        for m, w in points[1:]:
+            q = (cum + (cur_w + w) / 2) / self.total
+            if cur_w + w <= 4 * self.total * q * (1 - q) / self.compression:
+                cur_m = (cur_m * cur_w + m * w) / (cur_w + w)
+                cur_w += w
+            else:
+                means.append(cur_m)
+                weights.append(cur_w)
+                cum += cur_w
+                cur_m, cur_w = m, w
+        means.append(cur_m)
+        weights.append(cur_w)
+        self.means, self.weights = means, weights
+
+    def quantile(self, q):
+        """
+        :param q: the requested quantile, between 0 and 1
+        :return: the estimated value at the given quantile
+        """
+        self._compress()
+        if len(self.means) == 0:
+            return np.nan
+        if len(self.means) == 1:
+            return self.means[0]
+        weights = np.array(self.weights)
+        centers = np.cumsum(weights) - weights / 2  # the cumulative weight at the center of each centroid
+        return float(np.interp(q * self.total, centers, self.means))
+
+    def trimmed_mean(self, trim):
+        """
+        :param trim: the fraction of the weight to disregard at each tail
+        :return: the weighted mean of the values between the trim and 1-trim quantiles
+        """
+        self._compress()
+        if len(self.means) == 0:
+            return np.nan
+        weights = np.array(self.weights)
+        ends = np.cumsum(weights)
+        lo, hi = trim * self.total, (1 - trim) * self.total
+        overlap = np.clip(np.minimum(ends, hi) - np.maximum(ends - weights, lo), 0, None)
+        if np.sum(overlap) == 0:  # everything was trimmed, fall back to the median
+            return self.quantile(0.5)
+        return float(np.sum(overlap * np.array(self.means)) / np.sum(overlap))
+
+    def result(self):
+        return self.quantile(0.5)
+
+    def to_dict(self):
+        self._compress()
+        return {'kind': self.kind, 'compression': self.compression, 'means': self.means, 'weights': self.weights,
+                'total': self.total, 'n': self.n}
+
+    def load_dict(self, state):
+        self.compression = state['compression']
+        self.means, self.weights = list(state['means']), list(state['weights'])
+        self.total, self.n = state['total'], state['n']
+
+
+class TrimmedMean(TDigest):
+    """
+    A streaming weighted trimmed mean, estimated from a t-digest of the values
+    """
+
+    kind = 'trimmed'
+
+    def __init__(self, trim=0.1, compression=50):
+        super().__init__(compression)
+        self.trim = trim
+
+    def result(self):
+        return self.trimmed_mean(self.trim)
+
+    def to_dict(self):
+        state = super().to_dict()
+        state['trim'] = self.trim
+        return state
+
+    def load_dict(self, state):
+        super().load_dict(state)
+        self.trim = state['trim']
+
+
+estimators = {'mean': WeightedMean, 'median': TDigest, 'trimmed': TrimmedMean}
+
+
+def make_estimator(name):
+    """
+    :param name: the name of the estimator, one of the keys of estimators
+    :return: a new (empty) estimator
+    """
+    if name not in estimators:
+        raise ValueError('unknown estimator ' + str(name) + ', should be one of ' + ', '.join(estimators))
+    return estimators[name]()
+
+
+def estimator_from_dict(state):
+    """
+    :param state: a dictionary, as given by the to_dict method of an estimator
+    :return: the estimator with the given state
+    """
+    estimator = make_estimator(state['kind'])
+    estimator.load_dict(state)
+    return estimator
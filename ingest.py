@@ -0,0 +1,175 @@
+import os
+import sys
+import json
+import time
+from pathlib import Path
+
+from loader import prefetch
+from metadata import index_dir, metadata_file, load_metadata, metadata_row
+from preprocess import normalize_recipe, normalize_recipes, recipe_score
+from recipe_ir import IRCache, load_ir_cache
+from title_index import TitleIndex, title_index_file
+from dedup import DuplicateIndex, duplicate_index_file
+
+
+manifest_file = 'manifest.json'
+watch_interval = 5  # the number of seconds between scans in watch mode
+
+
+def scan_recipes(json_path):
+    """
+    :param json_path: the directory where the downloaded recipes are found
+    :return: a dictionary of the modification time (in nanoseconds) and size of each recipe file
+    """
+    return {entry.name: [entry.stat().st_mtime_ns, entry.stat().st_size] for entry in os.scandir(json_path)
+            if entry.name.endswith('.json')}
+
+
+def load_manifest(json_path):
+    """
+    :return: the saved manifest of the ingested recipe files (file name -> [<mtime>, <size>, <IRCache key>]), or
+             None if the recipes were never ingested
+    """
+    path = index_dir(json_path) / manifest_file
+    if not path.exists():
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def seed_manifest(json_path, meta, current):
+    """
+    Create the manifest of the first ingestion from the metadata table. The files that weren't modified since
+    the table was saved are taken to be up to date, and are read once for their IRCache keys, while the files
+    that were modified since then are left out of the manifest's content, so they are ingested as changed
+    :param json_path: the directory where the downloaded recipes are found
+    :param meta: the RecipeMetadata table of the recipes
+    :param current: the scanned recipe files, as returned by scan_recipes
+    :return: the manifest of the recipes in the table
+    """
+    built = (index_dir(json_path) / metadata_file).stat().st_mtime_ns
+    manifest = {}
+    for f in meta.files:
+        f = str(f)
+        if f in current and current[f][0] <= built:
+            manifest[f] = current[f] + [None]
+        else:
+            manifest[f] = [None, None, None]
+    unchanged = [f for f in manifest if manifest[f][0] is not None]
+    for f, recipe in zip(unchanged, normalize_recipes(prefetch(Path(json_path) / f for f in unchanged))):
+        manifest[f][2] = IRCache.key(recipe)
+    return manifest
+
+
+def save_manifest(json_path, manifest):
+    with open(index_dir(json_path) / manifest_file, 'w') as f:
+        json.dump(manifest, f)
+
+
+def ingest(json_path, parse=False):
+    """
+    Bring everything derived from the recipe files up to date with them. The files are compared to the manifest of
+    the last ingestion, and only the added, changed and deleted files are read. The metadata table is updated, and
+    so are the title index and the near-duplicate index if they were built. The parsed recipes of changed and
+    deleted files are removed from the IR cache
+    :param json_path: the directory where the downloaded recipes are found
+    :param parse: True if the added and changed recipes should also be parsed into the IR cache
+    :return: a dictionary of the number of added, changed and deleted files and the time it took (in seconds)
+    """
+    start = time.time()
+    index = index_dir(json_path)
+    meta = load_metadata(json_path)
+    current = scan_recipes(json_path)
+    manifest = load_manifest(json_path)
+    first = manifest is None
+    if first:
+        manifest = seed_manifest(json_path, meta, current)
+
+    added = sorted(name for name in current if name not in manifest)
+    deleted = sorted(name for name in manifest if name not in current)
+    changed = sorted(name for name in current if name in manifest and manifest[name][:2] != current[name])
+    stats = {'added': len(added), 'changed': len(changed), 'deleted': len(deleted)}
+    if len(added) + len(deleted) + len(changed) == 0:
+        if first:
+            save_manifest(json_path, manifest)
+        stats['seconds'] = time.time() - start
+        return stats
+
+    titles_path, duplicates_path = index / title_index_file, index / duplicate_index_file
+    titles = TitleIndex.load(titles_path) if titles_path.exists() else None
+    duplicates = DuplicateIndex.load(duplicates_path) if duplicates_path.exists() else None
+    cache = load_ir_cache(json_path)
+
+    for name in deleted + changed:
+        if manifest[name][2] is not None:
+            cache.discard(manifest[name][2])
+        for derived in (titles, duplicates):
+            if derived is not None:
+                derived.remove(name)
+    for name in deleted:
+        del manifest[name]
+
+    rows = []
+    updates = added + changed
+    for name, recipe in zip(updates, prefetch(Path(json_path) / name for name in updates)):
+        row = metadata_row(name, recipe)
+        rows.append(row)
+        recipe = normalize_recipe(recipe)
+        if titles is not None:
+            titles.add(name, row[1], float(recipe_score(row[5], row[6], row[7])))
+        if duplicates is not None:
+            duplicates.add(name, recipe)
+        if parse:
+            cache.parse(recipe)
+        manifest[name] = current[name] + [IRCache.key(recipe)]
+
+    meta.updated(deleted + changed, rows).save(index / metadata_file)
+    if titles is not None:
+        titles.save(titles_path)
+    if duplicates is not None:
+        duplicates.save(duplicates_path)
+    save_manifest(json_path, manifest)
+    stats['seconds'] = time.time() - start
+    return stats
+
+
+def report(stats):
+    """
+    :return: a description of an ingestion, as returned by ingest
+    """
+    num_files = stats['added'] + stats['changed'] + stats['deleted']
+    rate = num_files / stats['seconds'] if stats['seconds'] > 0 else 0
+    return ('Ingested ' + str(stats['added']) + ' added, ' + str(stats['changed']) + ' changed and ' +
+            str(stats['deleted']) + ' deleted recipes in ' + str(round(stats['seconds'], 2)) + ' seconds (' +
+            str(round(rate, 1)) + ' files per second)')
+
+
+def watch(json_path, parse=False, interval=watch_interval):
+    """
+    Ingest the recipes whenever their files change, until interrupted (Ctrl+C)
+    :param json_path: the directory where the downloaded recipes are found
+    :param parse: True if the added and changed recipes should also be parsed
+    :param interval: the number of seconds between scans of the recipes directory
+    """
+    try:
+        while True:
+            stats = ingest(json_path, parse)
+            if stats['added'] + stats['changed'] + stats['deleted'] > 0:
+                print(report(stats))
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    json_path = Path(os.path.dirname(os.path.realpath(__file__)) + '/jsons/')
+    parse = '--parse' in sys.argv
+    if '--watch' in sys.argv:
+        print('Watching ' + str(json_path) + ' for changed recipes (press Ctrl+C to stop)...')
+        watch(json_path, parse)
+    else:
+        print(report(ingest(json_path, parse)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import os
+import json
+import time
+from collections import Counter
+from pathlib import Path
+
+from metadata import index_dir, load_metadata
+from preprocess import split_ingredients
+
+
+lexicon_file = 'lexicon.json'
+
+
+class Lexicon:
+    """
+    A precomputed table of the word-level answers ingredient_prep needs: whether a word is an '-ed' verb or
+    adjective, whether it is a stop word and its lemma. It's built once from the ingredients of the corpus with
+    the full models, so the lite backend answers these by lookup
+    """
+
+    def __init__(self, entries=None):
+        self.entries = entries if entries is not None else {}  # word -> [<is '-ed' verb>, <is stop>, <lemma>]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, word):
+        """
+        :return: the (<is '-ed' verb>, <is stop>, <lemma>) entry of the word, or None if it isn't in the lexicon
+        """
+        return self.entries.get(word)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.entries, f)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'r') as f:
+            return Lexicon(json.load(f))
+
+
+def nlp_backend(lexicon=None):
+    """
+    The NLP backend of directions2pairs.ingredient_prep is chosen by the lexicon it's given: without one ('full')
+    words are tagged with nltk and spacy, and with one ('lite') they're looked up in it first, falling back to
+    the full models for the words missing from it
+    :param lexicon: the Lexicon of the lite backend, None for the full backend
+    :return: the name of the backend
+    """
+    return 'full' if lexicon is None else 'lite'
+
+
+def ingredient_lines(recipes):
+    """
+    :param recipes: an iterable of normalized recipes
+    :return: a generator of the ingredient names of the recipes, as they are given to ingredient_prep
+    """
+    for recipe in recipes:
+        for ing, _, _ in split_ingredients(recipe['Ingredients']):
+            yield ing
+
+
+def build_lexicon(lines):
+    """
+    Tag the words of the given ingredients with the full models. As nltk tags words in context, an '-ed' word
+    is marked as a verb if it was tagged so in most of its occurrences
+    :param lines: an iterable of ingredient names
+    :return: a Lexicon object
+    """
+    import nltk
+    from directions2pairs import tagger
+
+    words = set()
+    ed_counts, verb_counts = Counter(), Counter()  # the occurrences of each '-ed' word, and its verb tags
+    for ing in lines:
+        tags = nltk.pos_tag(ing.replace(',', '').split(), tagset='universal')
+        for word, tag in tags:
+            words.add(word)
+            if word[-2:] == 'ed':
+                ed_counts[word] += 1
+                verb_counts[word] += tag == 'VERB' or tag == 'ADJ'
+
+    entries = {}
+    for word in words:
+        token = tagger(word)[0]
+        entries[word] = [2 * verb_counts[word] > ed_counts[word], token.is_stop, token.lemma_]
+    return Lexicon(entries)
+
+
+def backend_agreement(lines, lexicon):
+    """
+    Compare the lite backend to the full one
+    :param lines: a list of ingredient names
+    :param lexicon: the Lexicon of the lite backend
+    :return: a tuple of the fraction of the ingredients for which both backends agree, and the time each of them
+             took (in seconds)
+    """
+    from directions2pairs import ingredient_prep
+
+    start = time.time()
+    full = [ingredient_prep([ing]) for ing in lines]
+    full_time = time.time() - start
+    start = time.time()
+    lite = [ingredient_prep([ing], lexicon) for ing in lines]
+    lite_time = time.time() - start
+    agree = sum(a == b for a, b in zip(full, lite))
+    return agree / max(len(lines), 1), full_time, lite_time
+
+
+def load_lexicon(json_path):
+    """
+    :param json_path: the directory where the downloaded recipes are found
+    :return: the saved Lexicon of the recipes, or None if it wasn't built
+    """
+    path = index_dir(json_path) / lexicon_file
+    return Lexicon.load(path) if path.exists() else None
+
+
+def main():
+    json_path = Path(os.path.dirname(os.path.realpath(__file__)) + '/jsons/')
+    recipes = load_metadata(json_path)
+    print('Tagging the ingredients of all of the recipes (might take a while)...')
+    lexicon = build_lexicon(ingredient_lines(recipes.iter_recipes()))
+    lexicon.save(index_dir(json_path) / lexicon_file)
+    print('Found ' + str(len(lexicon)) + ' words.')
+
+    sample = list(ingredient_lines(recipes.subset(list(range(min(len(recipes), 200)))).iter_recipes()))
+    agreement, full_time, lite_time = backend_agreement(sample, lexicon)
+    print('The lite backend agrees with the full one on ' + str(round(100 * agreement, 2)) + '% of ' +
+          str(len(sample)) + ' ingredients, and is ' + str(round(full_time / max(lite_time, 1e-9), 1)) +
+          ' times faster.')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+try:  # ujson decodes the recipe files considerably faster, but is not required
+    import ujson as json_decoder
+except ImportError:
+    import json as json_decoder
+
+
+num_workers = 8     # the number of files read concurrently
+prefetch_size = 32  # the maximal number of files read ahead of the consumer
+
+
+def read_recipe(path):
+    """
+    Read and decode a single recipe file
+    :param path: the path of the recipe file
+    :return: the recipe dictionary
+    """
+    with open(path, 'rb') as f:
+        return json_decoder.loads(f.read())
+
+
+def prefetch(items, load=read_recipe, workers=num_workers, max_ahead=prefetch_size):
+    """
+    Load the given items concurrently with a bounded thread pool, while the consumer works on the items that
+    were already loaded. At most max_ahead items are loaded (or being loaded) ahead of the consumer, so a slow
+    consumer holds back the loading instead of piling up loaded items in memory
+    :param items: an iterable of the items to load, e.g. file paths
+    :param load: the function that loads a single item. It runs in the worker threads, so it can also do some
+            of the downstream work (e.g. normalizing the recipe)
+    :param workers: the number of worker threads
+    :param max_ahead: the maximal number of items loaded ahead of the consumer
+    :return: a generator of the loaded items, in the order of the given items
+    """
+    items = iter(items)
+    pool = ThreadPoolExecutor(max_workers=workers)
+    pending = deque(pool.submit(load, item) for item in islice(items, max_ahead))
+    try:
+        while pending:
+            future = pending.popleft()
+            for item in islice(items, 1):
+                pending.append(pool.submit(load, item))
+            yield future.result()
+    finally:
+        # the consumer may stop early, in which case the remaining loads are dropped
+        for future in pending:
+            future.cancel()
+        pool.shutdown(wait=True)
@@ -1,6 +1,16 @@
 from preprocess import *
+from itertools import repeat
+from collections import Counter
+from multiprocessing import Pool
+import json
+from pathlib import Path
 import numpy as np
-from directions2pairs import cooking_devices, ingredient_prep, find_verb_tuples
+from directions2pairs import cooking_devices
+from recipe_ir import DeviceEvent, IRCache, parse_recipe_ir, parse_device_action
+from metadata import RecipeMetadata, top_rows
+from dedup import remove_duplicates
+from estimators import make_estimator, estimator_from_dict
+from loader import prefetch, num_workers
 from wordcloud import WordCloud
 from matplotlib import pyplot as plt
 
@@ -40,18 +50,35 @@ class MIngredient:
     A class that holds all occurrences of an ingredient and provides support for merging operations
     """
 
-    def __init__(self, name, quantity, unit, verb, preaction, step, score):
+    def __init__(self, name, quantity, unit, verb, preaction, step, score, estimator='mean', oven_reading=None):
+        """
+        :param oven_reading: the already parsed (<time>, <temperature>) of an oven, by default parsed from the verb
+        """
         self.name = name
 
+        # the occurrences are summarized by fixed size aggregates, so an ingredient's size doesn't grow with the
+        # number of merged recipes: an estimator of the quantities for each unit of measurement, the counts of
+        # the verbs and preactions, and score weighted sums of the steps
         quantity, unit = quantity_to_vol(quantity, unit)
-        self.quants = [quantity]
-        self.meas = [unit]
-        self.verbs = [verb]
-        self.preacts = preaction
-        self.steps = [step]
-        self.scores = [score]
+        self.units = Counter({unit: 1})
+        self.amounts = {unit: make_estimator(estimator)}
+        self.amounts[unit].add(quantity, score)
+        self.verbs = Counter([verb])
+        self.preacts = Counter(preaction)
+        self.score = score
+        self.weighted_step = step*score
 
         self.oven = True if name == 'oven' else False
+        # the score weighted sums of the baking temperatures and (positive) times of an oven, the total score of
+        # the times and their number
+        self.oven_temp, self.oven_time, self.oven_time_score, self.oven_time_count = 0.0, 0.0, 0.0, 0
+        if self.oven:
+            time, temp = parse_device_action(verb) if oven_reading is None else oven_reading
+            temp = temp if temp is not None else 180
+            self.oven_temp = temp*score
+            if time > 0:
+                self.oven_time, self.oven_time_score, self.oven_time_count = time*score, score, 1
+        self.canon = None  # the canonical id of the ingredient, if its name is in a CanonicalTable
 
     def __lt__(self, other):
         if self.name < other.name:
@@ -64,214 +91,546 @@ class MIngredient:
     def merge(self, other):
         n = other.name if self.name < other.name else self.name
         self.name = n
-        self.quants += other.quants
-        self.meas += other.meas
+        self.units += other.units
+        for unit, amount in other.amounts.items():
+            if unit in self.amounts:
+                self.amounts[unit].merge(amount)
+            else:
+                self.amounts[unit] = amount
         self.verbs += other.verbs
         self.preacts += other.preacts
-        self.steps += other.steps
-        self.scores += other.scores
+        self.score += other.score
+        self.weighted_step += other.weighted_step
+        self.oven_temp += other.oven_temp
+        self.oven_time += other.oven_time
+        self.oven_time_score += other.oven_time_score
+        self.oven_time_count += other.oven_time_count
+
+    @staticmethod
+    def most_common(counts):
+        # the most common value, ties are broken alphabetically
+        return min(counts, key=lambda v: (-counts[v], v))
 
     def get_verb(self):
         if self.oven:
             return self.__oven_verb()
-        unique, counts = np.unique(self.verbs, return_counts=True)
-        return unique[np.argmax(counts)]
+        return MIngredient.most_common(self.verbs)
 
     def get_preaction(self):
-        unique, counts = np.unique(self.preacts, return_counts=True)
-        return unique[np.argmax(counts)]
+        return MIngredient.most_common(self.preacts)
 
     def get_amount(self):
         """
-        :return: the weighted average quantity of the ingredient
+        :return: the estimated quantity of the ingredient (by default the weighted average), in its most
+                 common unit of measurement
         """
-        m = self.get_unit()
-        scores = np.array([self.scores[i] for i in range(len(self.meas)) if self.meas[i] == m])
-        q = np.array([self.quants[i] for i in range(len(self.meas)) if self.meas[i] == m])
-        amnt = np.sum(scores*q/np.sum(scores))
-        return amnt
+        return self.amounts[self.get_unit()].result()
 
     def get_unit(self):
-        unique, counts = np.unique(self.meas, return_counts=True)
-        return unique[np.argmax(counts)]
+        # the most common unit, ties are broken alphabetically
+        return min(self.units, key=lambda u: (-self.units[u], u))
 
     def get_step(self):
-        scores = np.array(self.scores)
-        return np.sum(np.array(self.steps) * scores / np.sum(scores))
+        return self.weighted_step / self.score
 
     def __oven_verb(self):
         """
         :return: the "correct" verb for oven (including baking time and temperature)
         """
-        scores = np.array(self.scores)
-        cooking_time = []
-        cooking_temp = []
-        for v in self.verbs:
-            numbers = [a for a in v.split() if a.isnumeric()]
-            if len(numbers) < 2:
-                cooking_time.append(0)
-            else:
-                cooking_time.append(int(numbers[1]) if v.split()[-1] == 'minutes' else 60*int(numbers[1]))
-            if len(numbers) < 1:
-                cooking_temp.append(180)
-            else: cooking_temp.append(int(numbers[0]))
-        temp = np.sum(np.array(cooking_temp) * scores / np.sum(scores))
-        cooking_time = np.array(cooking_time)
-        if len(cooking_time[cooking_time > 0]) == 0:
+        temp = self.oven_temp / self.score
+        if self.oven_time_count == 0:
             time = 'until golden'
         else:
-            time = cooking_time[cooking_time > 0] * scores[cooking_time > 0] / np.sum(scores[cooking_time > 0])
-            time = np.sum(time)
+            time = np.round(self.oven_time / self.oven_time_score, 6)  # so rounding errors aren't truncated
             time = 'for ' + str(int(time)) + ' minutes'
         temp = np.round(temp/5)*5
         return 'bake at ' + str(int(temp)) + ' C ' + time
 
+    def to_dict(self):
+        """
+        :return: a JSON serializable dictionary of the ingredient's state
+        """
+        return {'name': str(self.name), 'units': dict(self.units),
+                'amounts': {u: a.to_dict() for u, a in self.amounts.items()},
+                'verbs': {str(v): c for v, c in self.verbs.items()},
+                'preacts': {str(p): c for p, c in self.preacts.items()},
+                'score': float(self.score), 'weighted_step': float(self.weighted_step),
+                'oven': [float(self.oven_temp), float(self.oven_time), float(self.oven_time_score),
+                         self.oven_time_count], 'canon': self.canon}
+
+    @staticmethod
+    def from_dict(state):
+        """
+        :param state: a dictionary, as given by to_dict
+        :return: the MIngredient with the given state
+        """
+        ing = MIngredient.__new__(MIngredient)
+        ing.name = state['name']
+        ing.units = Counter(state['units'])
+        ing.amounts = {u: estimator_from_dict(a) for u, a in state['amounts'].items()}
+        ing.verbs = Counter(state['verbs'])
+        ing.preacts = Counter(state['preacts'])
+        ing.score = state['score']
+        ing.weighted_step = state['weighted_step']
+        ing.oven = True if ing.name == 'oven' else False
+        ing.oven_temp, ing.oven_time, ing.oven_time_score, ing.oven_time_count = state['oven']
+        ing.canon = state['canon']
+        return ing
+
     @staticmethod
     def step_key(ing):
         return ing.get_step()
 
     @staticmethod
     def score_key(ing):
-        s = np.sum(ing.scores)
-        return s if not np.isnan(s) else 0
+        return ing.score if not np.isnan(ing.score) else 0
 
     @staticmethod
-    def build_ings(ings_table, prep, ing_tuples, indxs, num_serve, score):
-        # extract quantities and measurement units
-        quants = [float(a[1])/num_serve for a in ings_table]
-        meas = [a[2] for a in ings_table]
-
-        # reorder by the verb tuples
-        indxs = [ind for a in indxs for ind in a]
-        quants = [quants[i] if i != -1 else -1 for i in indxs]
-        meas = [meas[i] if i != -1 else '' for i in indxs]
-        prep = [prep[i] if i != -1 else [] for i in indxs]
-
-        # extract needed variables
-        steps = [i for i, a in enumerate(ing_tuples) for _ in a[1]]
-        ings = [tup[0] for step in ing_tuples for tup in step[1]]
-        verbs = [tup[1] for step in ing_tuples for tup in step[1]]
-
-        # make sure each ingredient has something in the prep and change format
-        for i, p in enumerate(prep):
-            if len(p) == 0:
-                prep[i].append('')
-            else:
-                new = []
-                for act in p:
-                    new.append(act[1])
-                prep[i] = new
-
+    def build_ings(parsed, estimator='mean'):
+        """
+        :param parsed: a ParsedRecipe object
+        :param estimator: the name of the quantity estimator of the ingredients (see estimators.py)
+        :return: a list of the MIngredients of the recipe, ordered by the steps they are used in
+        """
         ing_objs = []
-        for i, ing in enumerate(ings):
-            tmp = MIngredient(ing, quants[i], meas[i], verbs[i], prep[i], steps[i], score)
-            ing_objs.append(tmp)
+        for step, group in enumerate(parsed.groups):
+            for event in group.events:
+                if isinstance(event, DeviceEvent):
+                    # an oven uses the already parsed time and temperature
+                    tmp = MIngredient(event.device, -1, '', event.action, [''], step, parsed.score, estimator,
+                                      (event.time, event.temp))
+                else:
+                    line = parsed.ingredients[event.ingredient]
+                    preacts = list(line.preactions) if len(line.preactions) > 0 else ['']
+                    tmp = MIngredient(event.name, line.quantity/parsed.servings, line.unit, event.verb, preacts,
+                                      step, parsed.score, estimator)
+                ing_objs.append(tmp)
         return ing_objs
 
 
-def recipe_score(rating, num_rated, num_made):
-    """
-    Calculate the score of the recipe according to our scoring scheme
-    :param rating: the user's rating of the recipe
-    :param num_rated: number of users that rated the recipe
-    :param num_made: number of users who have stated that they used the recipe
-    :return: the score of the recipe
-    """
-    return np.log(rating*num_rated*num_made + 1)  # TODO choose a better scoring scheme
-
-
-def parse_recipe(recipe):
+def parse_recipe(recipe, score=None, estimator='mean', cache=None, lexicon=None, prefilter=None):
     """
     Parse a single recipe
     :param recipe: a dictionary containing all of the necessary details about the recipe in question
+    :param score: the recipe's score, if it was already computed
+    :param estimator: the name of the quantity estimator of the ingredients (see estimators.py)
+    :param cache: an IRCache of the parsed recipes, if the parsing should be cached
+    :param lexicon: the Lexicon of the lite NLP backend (see lexicon.py), None for the full backend
+    :param prefilter: if given, a Counter of the directions prefilter's pairs, which is updated (see
+            directions2pairs.find_correlations)
     :return: a tuple containing
                 - the number of servings in the recipe
                 - the recipe's score
                 - a list of MIngredients used in the recipe
     """
-    directions = recipe['Directions']
-    ingredients = recipe['Ingredients']
-    num_rated = float(recipe['NumReviews'])
-    num_made = float(recipe['NumMadeIt'])
-    rating = float(recipe['Rating'])
-    num_serv = float(recipe['NumServings'])
-    score = recipe_score(rating, num_rated, num_made)
-
-    # strip ingredient names from quantities and measurement units
-    ings_table = split_ingredients(ingredients)
-    true_ings, prep = ingredient_prep([x[0] for x in ings_table])
-    ingredient_tups, ind = find_verb_tuples(directions, true_ings)
-    return num_serv, score, MIngredient.build_ings(ings_table, prep, ingredient_tups, ind, num_serv, score)
-
-
-def parse_relevant_recipes(recipes, ing_restriction=lambda _: True):
+    parsed = parse_recipe_ir(recipe, score, lexicon, prefilter) if cache is None else \
+        cache.parse(recipe, score, lexicon, prefilter)
+    return parsed.servings, parsed.score, MIngredient.build_ings(parsed, estimator)
+
+
+def merge_ingredients(ings, rec_ings, by_canon=None):
+    """
+    Merge the ingredients of a recipe into the merged ingredients. Each of the recipe's ingredients is merged
+    into the first copy of it, or added as a new ingredient if there is no such copy
+    :param ings: the list of merged MIngredients (updated in place)
+    :param rec_ings: the MIngredients of a single recipe
+    :param by_canon: a dictionary of the merged MIngredients by their canonical ids (updated in place). An
+            ingredient with a canonical id is merged by looking its id up, and only ingredients without an id
+            are compared by their names
     """
-    Parse all of the relevant recipes for data needed
-    :param recipes: a list of dictionaries containing all necessary parts of the recipe
+    num_merged = len(ings)
+    for r in rec_ings:
+        if by_canon is not None and r.canon is not None:
+            if r.canon in by_canon:
+                by_canon[r.canon].merge(r)
+            else:
+                by_canon[r.canon] = r
+                ings.append(r)
+            continue
+        for ing in ings[:num_merged]:
+            if ing == r:
+                ing.merge(r)
+                break
+        else:
+            ings.append(r)
+
+
+def parse_relevant_recipes(recipes, ing_restriction=lambda _: True, recipe_scores=None, estimator='mean',
+                           canonical=None, cache=None, progress=None, lexicon=None, prefilter=None):
+    """
+    Parse all of the relevant recipes for data needed. The recipes are consumed one at a time, and only the
+    merged ingredients are kept, so the recipes can be given as a generator
+    :param recipes: an iterable of dictionaries containing all necessary parts of the recipe, or a
+            dictionary of such dictionaries
     :param ing_restriction: a restriction on the number of ingredients
+    :param recipe_scores: an iterable of the already computed scores of the recipes, in the recipes' order
+    :param estimator: the name of the quantity estimator of the ingredients (see estimators.py)
+    :param canonical: a CanonicalTable of the ingredient names, used to merge the ingredients by their ids
+    :param cache: an IRCache of the parsed recipes, if the parsing should be cached
+    :param progress: a Progress object (see progress.py), updated after each recipe. If its token is stopped,
+            the parsing stops and only the recipes parsed until then are merged
+    :param lexicon: the Lexicon of the lite NLP backend, None for the full backend
+    :param prefilter: if given, a Counter of the directions prefilter's pairs, which is updated
     :return: a tuple containing
              - the average number of servings
              - the score of each recipe
              - the average number of ingredients used
              - a list of the ingredients from all the recipes
     """
-    ings = []
-    num_ings = []
-    scores = []
-    num_serves = []
-    for recipe in recipes:
+    return parse_partial(recipes, ing_restriction, recipe_scores, estimator, canonical, cache, progress,
+                         lexicon=lexicon, prefilter=prefilter).result()
+
+
+def parse_partial(recipes, ing_restriction=lambda _: True, recipe_scores=None, estimator='mean',
+                  canonical=None, cache=None, progress=None, deferred=False, lexicon=None, prefilter=None):
+    """
+    Parse the given recipes into a partial merge state, which can later be merged with the states of other
+    recipes. The other arguments are the same as in parse_relevant_recipes
+    :param deferred: True if the parsed recipes should be kept as they are and only merged when the state is
+            merged into another state (see PartialMerge)
+    :return: a PartialMerge object
+    """
+    if isinstance(recipes, dict):
+        recipes = recipes.values()
+    if recipe_scores is None:
+        recipe_scores = repeat(None)
+
+    state = PartialMerge(canonical, deferred)
+    for recipe, score in zip(recipes, recipe_scores):
+        if progress is not None and progress.should_stop():
+            break
 
         # add only if the recipe abides by the restrictions
-        if ing_restriction(len(recipes[recipe]['Ingredients'])):
+        if ing_restriction(len(recipe['Ingredients'])):
 
             # parse the recipe
-            ns, score, rec_ings = parse_recipe(recipes[recipe])
-            num_serves.append(ns)
-            scores.append(score)
-            num_ings.append(len(rec_ings))
-
-            # merge copies of the same ingredient
-            for i, ing in enumerate(ings):
-                for j, r in enumerate(rec_ings):
-                    to_pop = []
-                    if ing == r:
-                        ings[i].merge(r)
-                        to_pop.append(j)
-                    for tmp in to_pop:
-                        rec_ings.pop(tmp)
-            ings += rec_ings
-
-    # normalize scores to 1
-    scores = np.array(scores)
-    scores /= np.sum(scores)
-    return np.sum(np.array(num_serves)*scores), scores, np.sum(np.array(num_ings)*scores), ings
-
-
-def merge_baseline(recipes, special_ings=None, restrictions='', rest_func=lambda _: True, vis=True):
+            ns, score, rec_ings = parse_recipe(recipe, score, estimator, cache, lexicon, prefilter)
+            state.add_recipe(ns, score, rec_ings)
+
+        if progress is not None:
+            progress.update()
+    return state
+
+
+class PartialMerge:
+    """
+    The merge state of some of the recipes. Partial states of different recipes (e.g. shards of the corpus
+    that are parsed in different processes) can be merged. The scores are normalized only when the final result
+    is computed.
+    As ingredients are merged by their names' edit distance, which isn't transitive, and merging changes the
+    names, the merged ingredients depend on the order the recipes are merged in. A deferred state therefore
+    keeps the parsed ingredients of each of its recipes unmerged (so its size grows with its recipes), and they
+    are merged one recipe at a time when the state is merged into another state. Merging the deferred states of
+    consecutive shards in their order gives the same state as parsing all of the recipes serially, while
+    merging states that were already merged is only an approximation of it
+    """
+
+    def __init__(self, canonical=None, deferred=False):
+        self.ings = []
+        self.scores = []
+        self.weighted_serves = 0.0
+        self.weighted_ings = 0.0
+        self.canonical = canonical
+        self.by_canon = {}  # the merged ingredients by their canonical ids
+        self.deferred = deferred
+        self.recipes = []  # the (<number of servings>, <score>, <MIngredients>) of each recipe of a deferred state
+
+    def add_recipe(self, num_serves, score, rec_ings):
+        """
+        Add a parsed recipe to the state
+        :param num_serves: the number of servings in the recipe
+        :param score: the recipe's score
+        :param rec_ings: a list of the MIngredients of the recipe
+        """
+        if self.deferred:
+            self.recipes.append((num_serves, score, rec_ings))
+            return
+        self.scores.append(float(score))
+        self.weighted_serves += num_serves*score
+        self.weighted_ings += len(rec_ings)*score
+
+        # merge copies of the same ingredient
+        if self.canonical is not None:
+            for r in rec_ings:
+                r.canon = self.canonical.get(r.name)
+        merge_ingredients(self.ings, rec_ings, self.by_canon)
+
+    def merge(self, other):
+        """
+        Merge the state of the recipes that come after this state's recipes into this state. The other state's
+        ingredients are moved into this state, so it shouldn't be used afterwards
+        """
+        if self.deferred:
+            raise ValueError('a deferred state can only be merged into another state')
+        if other.deferred:
+            for num_serves, score, rec_ings in other.recipes:
+                self.add_recipe(num_serves, score, rec_ings)
+            return self
+        self.scores += other.scores
+        self.weighted_serves += other.weighted_serves
+        self.weighted_ings += other.weighted_ings
+        merge_ingredients(self.ings, other.ings, self.by_canon)
+        return self
+
+    def result(self):
+        """
+        :return: a tuple containing
+                 - the average number of servings
+                 - the (normalized) score of each recipe
+                 - the average number of ingredients used
+                 - a list of the ingredients from all the recipes
+        """
+        if self.deferred:
+            return PartialMerge(self.canonical).merge(self).result()
+
+        # normalize scores to 1
+        scores = np.array(self.scores)
+        total = np.sum(scores)
+        if total == 0:  # no recipes were parsed (e.g. the run was stopped right away)
+            return 0.0, scores, 0.0, self.ings
+        scores /= total
+        return self.weighted_serves/total, scores, self.weighted_ings/total, self.ings
+
+    def to_dict(self):
+        if self.deferred:
+            return {'recipes': [[float(ns), float(score), [ing.to_dict() for ing in rec_ings]]
+                                for ns, score, rec_ings in self.recipes]}
+        return {'scores': self.scores, 'weighted_serves': float(self.weighted_serves),
+                'weighted_ings': float(self.weighted_ings), 'ings': [ing.to_dict() for ing in self.ings]}
+
+    @staticmethod
+    def from_dict(state, canonical=None):
+        if 'recipes' in state:
+            partial = PartialMerge(canonical, deferred=True)
+            partial.recipes = [(ns, score, [MIngredient.from_dict(ing) for ing in rec_ings])
+                               for ns, score, rec_ings in state['recipes']]
+            return partial
+        partial = PartialMerge(canonical)
+        partial.scores = list(state['scores'])
+        partial.weighted_serves = state['weighted_serves']
+        partial.weighted_ings = state['weighted_ings']
+        partial.ings = [MIngredient.from_dict(ing) for ing in state['ings']]
+        partial.by_canon = {ing.canon: ing for ing in reversed(partial.ings) if ing.canon is not None}
+        return partial
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+    @staticmethod
+    def load(path, canonical=None):
+        with open(path, 'r') as f:
+            return PartialMerge.from_dict(json.load(f), canonical)
+
+
+def parse_shard(json_path, files, estimator='mean', out_path=None, canonical=None, cache_dir=None, scores=None,
+                lexicon=None):
+    """
+    Parse a shard of the recipes. This is the "map" step of a sharded merge, and can run in another process or
+    on another machine sharing the file system
+    :param json_path: the directory where the downloaded recipes are found
+    :param files: the file names of the recipes in the shard
+    :param estimator: the name of the quantity estimator of the ingredients (see estimators.py)
+    :param out_path: if given, the partial state is saved to this path
+    :param canonical: a CanonicalTable of the ingredient names
+    :param cache_dir: the directory of an IRCache of the parsed recipes, if the parsing should be cached
+    :param scores: the scores of the recipes in the shard, by default they are computed from the recipe files.
+            They should be given when the scores in the table were changed (e.g. pooled by remove_duplicates)
+    :param lexicon: the Lexicon of the lite NLP backend, None for the full backend
+    :return: the shard's (deferred) partial state, as a dictionary (see PartialMerge.to_dict)
+    """
+    recipes = normalize_recipes(prefetch(Path(json_path) / f for f in files))
+    cache = IRCache(cache_dir) if cache_dir is not None else None
+    state = parse_partial(recipes, recipe_scores=scores, estimator=estimator, canonical=canonical, cache=cache,
+                          deferred=True, lexicon=lexicon)
+    if out_path is not None:
+        state.save(out_path)
+    return state.to_dict()
+
+
+def reduce_partials(partials, canonical=None):
+    """
+    Merge partial states, in the order of their recipes. This is the "reduce" step of a sharded merge
+    :param partials: an iterable of PartialMerge objects, their dictionaries or paths of their saved files
+    :param canonical: the CanonicalTable the partial states were parsed with
+    :return: a PartialMerge object of all of the recipes
+    """
+    state = PartialMerge(canonical)
+    for partial in partials:
+        if isinstance(partial, dict):
+            partial = PartialMerge.from_dict(partial, canonical)
+        elif not isinstance(partial, PartialMerge):
+            partial = PartialMerge.load(partial, canonical)
+        state.merge(partial)
+    return state
+
+
+def parse_sharded(table, num_shards, estimator='mean', processes=None, canonical=None, cache=None, progress=None,
+                  lexicon=None):
+    """
+    Parse the recipes of a table in shards, in separate processes, and merge the results
+    :param table: a RecipeMetadata table of the recipes
+    :param num_shards: the number of (consecutive) shards to split the recipes into
+    :param estimator: the name of the quantity estimator of the ingredients (see estimators.py)
+    :param processes: the number of processes, by default the number of CPUs
+    :param canonical: a CanonicalTable of the ingredient names
+    :param cache: an IRCache of the parsed recipes, shared by the processes
+    :param progress: a Progress object, updated after each shard. If its token is stopped, the remaining shards
+            are terminated and only the shards that were done until then (in order) are merged
+    :param lexicon: the Lexicon of the lite NLP backend, None for the full backend
+    :return: a PartialMerge object of all of the recipes
+    """
+    # the scores are taken from the table, as they might differ from the files' (see remove_duplicates)
+    shards = [(list(files), list(scores)) for files, scores in
+              zip(np.array_split(table.files, num_shards), np.array_split(table.scores(), num_shards))
+              if len(files) > 0]
+    partials = []
+    with Pool(processes) as pool:  # leaving the pool terminates the shards that weren't collected
+        cache_dir = str(cache.directory) if cache is not None else None
+        results = [pool.apply_async(parse_shard, (str(table.json_path), files, estimator, None, canonical, cache_dir,
+                                                  scores, lexicon))
+                   for files, scores in shards]
+        for (files, _), result in zip(shards, results):
+            while not result.ready() and not (progress is not None and progress.should_stop()):
+                result.wait(0.5)
+            if not result.ready():
+                break
+            partials.append(result.get())
+            if progress is not None:
+                progress.update(len(files))
+    return reduce_partials(partials, canonical)
+
+
+def report_selection(stats):
+    """
+    :param stats: the statistics of a combination's recipe selection, as filled by merge_baseline
+    :return: a description of the near-duplicates that were removed and how many of the relevant recipes are
+             combined (with the lowest score of a combined recipe), one per line
+    """
+    lines = []
+    if stats.get('duplicates', 0) > 0:
+        lines.append('Found ' + str(stats['duplicates']) + ' near-duplicate recipes (' + stats['dedup'] + ')')
+    if 'selected' in stats:
+        num_selected, num_relevant = stats['selected'], stats['relevant']
+        if num_selected == num_relevant:
+            lines.append('Combining all of the ' + str(num_relevant) + ' recipes')
+        elif num_selected == 0:
+            lines.append('None of the ' + str(num_relevant) + ' recipes has a high enough score')
+        else:
+            lines.append('Combining the ' + str(num_selected) + ' top scored of ' + str(num_relevant) +
+                         ' recipes, with scores of at least ' + str(round(stats['cutoff'], 3)))
+    return '\n'.join(lines)
+
+
+def merge_baseline(recipes, special_ings=None, restrictions='', rest_func=lambda _: True, vis=True,
+                   estimator='mean', shards=1, canonical=None, cache=None, progress=None, max_recipes=None,
+                   min_score=None, duplicates=None, dedup='collapse', ctx=None, stats=None):
     """
     Baseline model for merging recipes, by taking their average
-    :param recipes: a list of dictionaries of the relevant recipes
+    :param recipes: a dictionary or an iterable of the relevant recipes, or a RecipeMetadata table of them.
+            Given a table, the restrictions and scores are computed from the table before any recipe is read,
+            and the recipes are then read and parsed one at a time
     :param special_ings: an option to add special ingredients
     :param restrictions: an option to add restrictions on the number of ingredients
     :param rest_func: the restrictions function on the number of ingredients
+    :param estimator: the estimator of the ingredients' quantities: 'mean' for the score-weighted mean,
+            'median' for the weighted median or 'trimmed' for the weighted trimmed mean (see estimators.py)
+    :param shards: the number of shards parsed in parallel processes (only for a RecipeMetadata table)
+    :param canonical: a CanonicalTable of the ingredient names (see canonical_ings.py). Ingredients whose names
+            are in the table are merged by their canonical ids, and only the rest are compared by edit distance
+    :param cache: an IRCache of the parsed recipes, if the parsing should be cached
+    :param progress: a Progress object (see progress.py) that reports the parsed recipes and can stop the run
+            early, in which case the recipes that were parsed until then are merged
+    :param max_recipes: if given, only this number of the top scored recipes (after the restrictions) are
+            combined. They are selected before any recipe is parsed, so the low scored recipes, which barely
+            affect the weighted result, aren't parsed at all
+    :param min_score: if given, only recipes with at least this score (see recipe_score) are combined
+    :param duplicates: a DuplicateIndex of the recipes (see dedup.py). If given, only one recipe of each group of
+            near-duplicates (the highest scored one) is combined, before the top scored recipes are selected
+    :param dedup: 'collapse' to give the combined recipe the score of all of its copies, or 'skip' to drop them
+    :param ctx: the PipelineContext of the query (see context.py). Its random state is used for the random
+            restrictions, its NLP backend for the parsing and its prefilter statistics are updated (except by
+            shards), and its tables and cache are used unless others are given (its near-duplicate index only for
+            a RecipeMetadata table). Concurrent queries should
+            each have their own context, and shouldn't create the (matplotlib) visualization
+    :param stats: if given, a dictionary that is filled with the statistics of the recipe selection: the number
+            of near-duplicates that were removed ('duplicates', with the 'dedup' mode), and if the top scored
+            recipes were selected, the number of 'relevant' and 'selected' recipes and the 'cutoff' score (see
+            report_selection)
     :return: a tuple containing:
              - the quantities of each ingredient
              - an ingredient tuple list as returned by directions2pairs.find_verb_tups
     """
-    num_ings = [len(recipes[recipe]['Ingredients']) for recipe in recipes]
-
+    stats = stats if stats is not None else {}
+    if ctx is not None:
+        canonical = canonical if canonical is not None else ctx.canonical
+        cache = cache if cache is not None else ctx.cache
+        if duplicates is None and isinstance(recipes, RecipeMetadata):  # the index only applies to a table
+            duplicates = ctx.duplicates
+    rng = ctx.rng if ctx is not None else np.random
+    lexicon = ctx.lexicon if ctx is not None else None
+    prefilter = ctx.prefilter if ctx is not None else None
+
+    if isinstance(recipes, RecipeMetadata):
+        num_ings = recipes.num_ingredients
+    elif isinstance(recipes, dict):
+        num_ings = [len(recipes[recipe]['Ingredients']) for recipe in recipes]
+    elif restrictions.lower() in ['simple', 'complex']:
+        raise ValueError('the ' + restrictions + ' restriction needs all of the recipes in advance, '
+                         'given as a dictionary or a RecipeMetadata table')
+
+    # the restrictions work on both single values and arrays of values
     if restrictions.lower() == 'fast':
-        rest_func = lambda _: True if np.random.random() <= 0.5 else False
+        rest_func = lambda x: rng.random(np.shape(x)) <= 0.5
     elif restrictions.lower() == 'veryfast':
-        rest_func = lambda _: True if np.random.random() <= 0.25 else False
+        rest_func = lambda x: rng.random(np.shape(x)) <= 0.25
     elif restrictions.lower() == 'simple':
         ni = np.quantile(num_ings, 0.2)
-        rest_func = lambda x: True if x <= ni else False
+        rest_func = lambda x: x <= ni
     elif restrictions.lower() == 'complex':
         ni = np.quantile(num_ings, 0.66)
-        rest_func = lambda x: True if x >= ni else False
-
-    ns, scores, avg_ings, ings = parse_relevant_recipes(recipes, rest_func)  # TODO add restrictions
+        rest_func = lambda x: x >= ni
+
+    # select the top scored recipes (of those that abide by the restrictions) before parsing any of them
+    capped = max_recipes is not None or min_score is not None
+    if duplicates is not None and not isinstance(recipes, RecipeMetadata):
+        raise ValueError('removing near-duplicate recipes needs a RecipeMetadata table of them')
+    if capped and not isinstance(recipes, (dict, RecipeMetadata)):
+        raise ValueError('selecting the top scored recipes needs all of the recipes in advance, '
+                         'given as a dictionary or a RecipeMetadata table')
+    if capped and isinstance(recipes, dict):
+        keys = [k for k in recipes if rest_func(len(recipes[k]['Ingredients']))]
+        rows, cutoff = top_rows([recipe_score(float(recipes[k]['Rating']), float(recipes[k]['NumReviews']),
+                                              float(recipes[k]['NumMadeIt'])) for k in keys],
+                                max_recipes, min_score)
+        stats.update(relevant=len(keys), selected=len(rows), cutoff=cutoff)
+        recipes = {keys[r]: recipes[keys[r]] for r in rows}
+        rest_func = lambda _: True
+
+    recipe_scores = None
+    if isinstance(recipes, RecipeMetadata):
+        table = recipes.ingredient_restriction(rest_func)
+        if duplicates is not None:
+            num_relevant = len(table)
+            table = remove_duplicates(table, duplicates, dedup)
+            stats.update(duplicates=num_relevant - len(table), dedup=dedup)
+        if capped:
+            num_relevant = len(table)
+            table, cutoff = table.top(max_recipes, min_score)
+            stats.update(relevant=num_relevant, selected=len(table), cutoff=cutoff)
+        recipe_scores = table.scores()
+        recipes = table.iter_recipes(ctx.workers if ctx is not None else num_workers)
+        rest_func = lambda _: True
+
+    if progress is not None:
+        progress.begin(len(recipe_scores) if recipe_scores is not None else
+                       len(recipes) if isinstance(recipes, dict) else None)
+    if shards > 1 and recipe_scores is not None:
+        ns, scores, avg_ings, ings = parse_sharded(table, shards, estimator, canonical=canonical,
+                                                   cache=cache, progress=progress, lexicon=lexicon).result()
+    else:
+        ns, scores, avg_ings, ings = parse_relevant_recipes(recipes, rest_func, recipe_scores, estimator,
+                                                            canonical, cache, progress, lexicon, prefilter)
     if vis:
         create_vis(ings)
 
@@ -0,0 +1,190 @@
+import os
+import heapq
+from pathlib import Path
+
+import numpy as np
+
+from loader import prefetch, read_recipe, num_workers
+from preprocess import recipe_score, split_instructions, normalize_recipe, normalize_recipes
+
+
+index_dir_name = 'index'
+metadata_file = 'metadata.npz'
+
+
+def index_dir(json_path):
+    """
+    The directory where the derived artifacts of the given recipes directory are kept
+    """
+    return Path(json_path).parent / index_dir_name
+
+
+def top_rows(scores, max_recipes=None, min_score=None):
+    """
+    Select the top scored recipes with a heap, without sorting all of the scores
+    :param scores: the score of each recipe
+    :param max_recipes: the maximal number of selected recipes, None for no limit. Of recipes with the same
+            score, the earlier ones are selected
+    :param min_score: the minimal score of a selected recipe, None for no minimum
+    :return: a tuple of the selected rows (in their original order) and the lowest selected score (the cut-off),
+             which is None if no recipe was selected
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    rows = np.arange(len(scores)) if min_score is None else np.flatnonzero(scores >= min_score)
+    if max_recipes is not None and len(rows) > max_recipes:
+        rows = np.sort(heapq.nlargest(max_recipes, rows, key=lambda r: scores[r]))
+    return rows, float(np.min(scores[rows])) if len(rows) > 0 else None
+
+
+class RecipeMetadata:
+    """
+    A columnar table of the recipes' metadata. Each column is a numpy array, and row i of all
+    columns describes the recipe in files[i]
+    """
+    columns = ('files', 'titles', 'num_ingredients', 'num_directions', 'servings', 'ratings', 'reviews',
+               'made_it')
+
+    def __init__(self, json_path, files, titles, num_ingredients, num_directions, servings, ratings, reviews,
+                 made_it):
+        self.json_path = Path(json_path)
+        self.files = np.asarray(files, dtype=str)
+        self.titles = np.asarray(titles, dtype=str)
+        self.num_ingredients = np.asarray(num_ingredients, dtype=np.int32)
+        self.num_directions = np.asarray(num_directions, dtype=np.int32)
+        self.servings = np.asarray(servings, dtype=np.float64)
+        self.ratings = np.asarray(ratings, dtype=np.float64)
+        self.reviews = np.asarray(reviews, dtype=np.float64)
+        self.made_it = np.asarray(made_it, dtype=np.float64)
+        self._lower_titles = None
+
+    def __len__(self):
+        return len(self.files)
+
+    def scores(self):
+        """
+        :return: the score of every recipe in the table, as given by recipe_score
+        """
+        return recipe_score(self.ratings, self.reviews, self.made_it)
+
+    def subset(self, rows):
+        """
+        :param rows: a boolean mask or an array of row indices
+        :return: a new table with only the given rows
+        """
+        return RecipeMetadata(self.json_path, *[getattr(self, c)[rows] for c in self.columns])
+
+    def match(self, recipe_name):
+        """
+        :param recipe_name: the name of the recipe
+        :return: a table of the recipes whose title contains the given name (case insensitive)
+        """
+        if self._lower_titles is None:
+            self._lower_titles = np.char.lower(self.titles)
+        return self.subset(np.char.find(self._lower_titles, recipe_name.lower()) >= 0)
+
+    def ingredient_restriction(self, rest_func):
+        """
+        Apply a restriction on the number of ingredients without reading any recipe
+        :param rest_func: the restriction function. It is first called with the whole column, and if that
+                doesn't return a boolean array it is called on every row separately
+        :return: a table of the recipes which abide by the restriction
+        """
+        try:
+            mask = rest_func(self.num_ingredients)
+        except (ValueError, TypeError):  # e.g. 'True if x <= ni else False' on an array
+            mask = None
+        if not isinstance(mask, np.ndarray) or mask.shape != self.num_ingredients.shape:
+            mask = np.array([bool(rest_func(x)) for x in self.num_ingredients], dtype=bool)
+        return self.subset(mask.astype(bool))
+
+    def top(self, max_recipes=None, min_score=None):
+        """
+        :param max_recipes: the maximal number of recipes, None for no limit
+        :param min_score: the minimal score of a recipe, None for no minimum
+        :return: a tuple of a table of the top scored recipes (see top_rows) and the cut-off score
+        """
+        rows, cutoff = top_rows(self.scores(), max_recipes, min_score)
+        return self.subset(rows), cutoff
+
+    def load_recipe(self, row):
+        """
+        Read and normalize the recipe in the given row
+        :return: a recipe dictionary, as given by get_recipes
+        """
+        return normalize_recipe(read_recipe(self.json_path / self.files[row]))
+
+    def iter_recipes(self, workers=num_workers):
+        """
+        :param workers: the number of threads reading the recipes
+        :return: a generator of the normalized recipes in the table, in row order. The recipes are read
+                 concurrently, ahead of the consumer, and normalized in batches
+        """
+        return normalize_recipes(prefetch((self.json_path / f for f in self.files), read_recipe, workers))
+
+    def recipes(self):
+        """
+        :return: a dictionary of all of the recipes in the table, keyed by their titles
+        """
+        return {recipe['Title']: recipe for recipe in self.iter_recipes()}
+
+    def updated(self, removed, rows):
+        """
+        :param removed: the file names of the recipes to remove from the table
+        :param rows: the metadata rows (see metadata_row) of the recipes to add to the table
+        :return: a new table without the removed recipes, and with the added recipes at its end
+        """
+        table = self.subset(~np.isin(self.files, list(removed))) if len(removed) > 0 else self
+        if len(rows) == 0:
+            return table
+        added = RecipeMetadata(self.json_path, *[list(col) for col in zip(*rows)])
+        return RecipeMetadata(self.json_path, *[np.concatenate([getattr(table, c), getattr(added, c)])
+                                                for c in self.columns])
+
+    def save(self, path):
+        np.savez(path, **{c: getattr(self, c) for c in self.columns})
+
+    @staticmethod
+    def load(path, json_path):
+        with np.load(path) as data:
+            return RecipeMetadata(json_path, *[data[c] for c in RecipeMetadata.columns])
+
+
+def metadata_row(filename, recipe):
+    """
+    :param filename: the file name of the recipe
+    :param recipe: the raw recipe dictionary, as read from the file
+    :return: the metadata row of the recipe, ordered as RecipeMetadata.columns
+    """
+    return (filename, recipe['Title'], len(recipe['Ingredients']), len(split_instructions(recipe['Directions'])),
+            float(recipe['NumServings']), float(recipe['Rating']), float(recipe['NumReviews']),
+            float(recipe['NumMadeIt']))
+
+
+def build_metadata(json_path):
+    """
+    Build the metadata table of all of the recipes in the given directory
+    :param json_path: the directory where the downloaded recipes are found
+    :return: a RecipeMetadata object
+    """
+    files = [x for x in os.listdir(json_path) if x.endswith('.json')]
+    recipes = prefetch(Path(json_path) / filename for filename in files)
+    rows = [metadata_row(filename, recipe) for filename, recipe in zip(files, recipes)]
+    cols = [list(col) for col in zip(*rows)] if rows else [[] for _ in RecipeMetadata.columns]
+    return RecipeMetadata(json_path, *cols)
+
+
+def load_metadata(json_path, rebuild=False):
+    """
+    Load the metadata table of the given recipes directory, building (and saving) it if it doesn't exist
+    :param json_path: the directory where the downloaded recipes are found
+    :param rebuild: True if the table should be rebuilt even if it exists
+    :return: a RecipeMetadata object
+    """
+    path = index_dir(json_path) / metadata_file
+    if path.exists() and not rebuild:
+        return RecipeMetadata.load(path, json_path)
+    meta = build_metadata(json_path)
+    if not path.parent.exists():
+        path.parent.mkdir()
+    meta.save(path)
+    return meta
@@ -1,11 +1,20 @@
-import json
 import os
 import re
+import numpy as np
+from itertools import islice
+from pathlib import Path
 from nltk.stem import PorterStemmer
+from loader import prefetch, num_workers
 
 
-reg1 = '^[0-9]*\.[0-9]+|^[0-9]+'
-reg2 = '^[0-9]+/[0-9]+'
+unicode_fractions = {'¼': 1/4, '½': 1/2, '¾': 3/4, '⅐': 1/7, '⅑': 1/9, '⅒': 1/10, '⅓': 1/3, '⅔': 2/3, '⅕': 1/5,
+                     '⅖': 2/5, '⅗': 3/5, '⅘': 4/5, '⅙': 1/6, '⅚': 5/6, '⅛': 1/8, '⅜': 3/8, '⅝': 5/8, '⅞': 7/8}
+# the numeric prefix of a word: a fraction, or an integer or a decimal optionally followed by a unicode fraction
+# (e.g. '1½'), or a unicode fraction alone
+quantity_re = re.compile(r'(?<!\S)(?:([0-9]+)/([0-9]+)|([0-9]*\.[0-9]+|[0-9]+)([{0}])?|([{0}]))'.format(
+    ''.join(unicode_fractions)))
+
+normalize_batch_size = 64  # the number of recipes whose quantities are parsed together
 
 ps = PorterStemmer()
 measureing_words = ['cup', 'spoon', 'tbsp', 'lbs', 'kg', 'gram', 'teaspoon', 'ounce', 'tablespoon',
@@ -22,32 +31,44 @@ def remove_brackets(ing_list):
     return [re.sub(r'\(.*?\)', '', ing).lower() for ing in ing_list]
 
 
+def parse_quantities(ing_list):
+    """
+    Find the quantities of a batch of ingredients (e.g. of many recipes) in a single pass over all of them. Every
+    word that starts with a number adds it to the ingredient's quantity (so mixed numbers, e.g. '1 1/2', are
+    summed), and that many words are dropped from the start of the ingredient
+    :param ing_list: a list of ingredients
+    :return: a tuple of a numpy array of the quantities, and a list of the ingredients without them
+    """
+    text = '\n'.join(ing_list)
+    starts = np.cumsum([0] + [len(ing) + 1 for ing in ing_list])[:-1]  # the offset of each ingredient
+    positions, values = [], []
+    for m in quantity_re.finditer(text):
+        num, den, number, fraction, alone = m.groups()
+        if num is not None:
+            value = int(num) / int(den)
+        elif number is not None:
+            value = float(number) + (unicode_fractions[fraction] if fraction is not None else 0)
+        else:
+            value = unicode_fractions[alone]
+        positions.append(m.start())
+        values.append(value)
+
+    rows = np.searchsorted(starts, positions, side='right') - 1
+    quantities = np.bincount(rows, np.array(values, dtype=float), minlength=len(ing_list)).astype(float)
+    counters = np.bincount(rows, minlength=len(ing_list))
+    return quantities, [' '.join(ing.split()[c:]) for ing, c in zip(ing_list, counters)]
+
+
 def ingredients_quantities_to_decimal(ing_list, num_dishes=1):
     """
     Changes the quantity of each ingredient to decimal value. Handles integer values and string
-    representations of fractions (e.g. '1/4')
+    representations of fractions (e.g. '1/4', '½')
     :param ing_list: current ingredient list
     :param num_dishes: the number of dishes specified in the recipe
     :return: the updated ingredients list
     """
-    new_ing_list = []
-    for ing in ing_list:
-        quant = 0
-        counter = 0
-        for n in ing.split():
-            res = re.findall(reg2, n)  # find fracs
-            for r in res:
-                counter += 1
-                slash = r.find('/')
-                quant += int(r[:slash]) / int(r[slash+1:])
-            if res:
-                continue
-            res = re.findall(reg1, n) # find ints and decimals
-            for r in res:
-                counter += 1
-                quant += float(r)
-        new_ing_list.append(str(round_nicely(quant/int(num_dishes))) + ' ' + ' '.join(ing.split()[counter:]))
-    return new_ing_list
+    quantities, rests = parse_quantities(ing_list)
+    return [str(round_nicely(quant/int(num_dishes))) + ' ' + rest for quant, rest in zip(quantities.tolist(), rests)]
 
 
 def round_nicely(num):
@@ -69,27 +90,91 @@ def split_instructions(inst_list):
     return new_inst_list
 
 
-def get_recipes(json_path, recipe_name):
+def iter_recipes(json_path, recipe_name, workers=num_workers):
+    """
+    Lazily read the available recipes with the given name, one at a time. The files are read and decoded
+    concurrently, ahead of the consumer
+    :param json_path: the directory where the downloaded recipes are found
+    :param recipe_name: the name of the recipe
+    :param workers: the number of threads reading the files
+    :return: a generator of the (raw) recipes of the requested dish
+    """
+    files = [Path(json_path) / x for x in os.listdir(json_path) if x.endswith('.json')]
+    for recipe in prefetch(files, workers=workers):
+        if recipe_name.lower() in recipe["Title"].lower():
+            yield recipe
+
+
+def normalize_recipe(recipe):
+    """
+    Normalize the ingredients and directions of a raw recipe
+    :param recipe: a recipe dictionary, as read from its file. It isn't changed
+    :return: a copy of the recipe with decimal quantities and atomic, lowercase directions
+    """
+    normalized = dict(recipe)
+    # normalized['Ingredients'] = ingredients_quantities_to_decimal(remove_brackets(recipe['Ingredients']), recipe['NumServings'])
+    normalized['Ingredients'] = ingredients_quantities_to_decimal(remove_brackets(recipe['Ingredients']), 1)  # un-normalized
+    normalized['Directions'] = split_instructions(recipe['Directions'])
+    return normalized
+
+
+def normalize_batch(recipes):
+    """
+    Normalize a batch of raw recipes, as normalize_recipe does. The quantities of all of the recipes'
+    ingredients are parsed together, in a single pass
+    :param recipes: a list of raw recipe dictionaries. They aren't changed
+    :return: a list of the normalized recipes
+    """
+    ing_lists = [remove_brackets(recipe['Ingredients']) for recipe in recipes]
+    quantities, rests = parse_quantities([ing for ings in ing_lists for ing in ings])
+    ings = [str(round_nicely(quant)) + ' ' + rest for quant, rest in zip(quantities.tolist(), rests)]
+    normalized = []
+    start = 0
+    for recipe, ing_list in zip(recipes, ing_lists):
+        recipe = dict(recipe)
+        recipe['Ingredients'] = ings[start:start+len(ing_list)]  # un-normalized
+        recipe['Directions'] = split_instructions(recipe['Directions'])
+        normalized.append(recipe)
+        start += len(ing_list)
+    return normalized
+
+
+def normalize_recipes(recipes, batch_size=normalize_batch_size):
+    """
+    Lazily normalize a stream of raw recipes, in batches (see normalize_batch)
+    :param recipes: an iterable of raw recipe dictionaries
+    :param batch_size: the number of recipes normalized together
+    :return: a generator of the normalized recipes
+    """
+    recipes = iter(recipes)
+    batch = list(islice(recipes, batch_size))
+    while batch:
+        yield from normalize_batch(batch)
+        batch = list(islice(recipes, batch_size))
+
+
+def get_recipes(json_path, recipe_name, ctx=None):
     """
     Create a dictionary of all the available recipes with the given name
     :param json_path: the directory where the downloaded recipes are found
     :param recipe_name: the name of the recipe
+    :param ctx: the PipelineContext of the query (see context.py), for the number of threads reading the files
     :return: a dictionary that contains only the recipes of the requested dish
     """
-    recipes = {}
-    files = [x for x in os.listdir(json_path) if x.endswith('.json')]
-    # add recipes with the given name
-    for filename in files:
-        with open(json_path / filename, 'r') as f:
-            recipe = json.load(f)
-            if recipe_name.lower() in recipe["Title"].lower():
-                recipes[recipe["Title"]] = recipe
-
-    for name, recipe in recipes.items():
-        # recipe['Ingredients'] = ingredients_quantities_to_decimal(remove_brackets(recipe['Ingredients']), recipe['NumServings'])
-        recipe['Ingredients'] = ingredients_quantities_to_decimal(remove_brackets(recipe['Ingredients']), 1)  # un-normalized
-        recipe['Directions'] = split_instructions(recipe['Directions'])
-    return recipes
+    workers = ctx.workers if ctx is not None else num_workers
+    recipes = {recipe["Title"]: recipe for recipe in iter_recipes(json_path, recipe_name, workers)}
+    return dict(zip(recipes, normalize_batch(list(recipes.values()))))
+
+
+def recipe_score(rating, num_rated, num_made):
+    """
+    Calculate the score of the recipe according to our scoring scheme
+    :param rating: the user's rating of the recipe
+    :param num_rated: number of users that rated the recipe
+    :param num_made: number of users who have stated that they used the recipe
+    :return: the score of the recipe
+    """
+    return np.log(rating*num_rated*num_made + 1)  # TODO choose a better scoring scheme
 
 
 def split_ingredients(ingredients):
@@ -0,0 +1,88 @@
+import time
+
+
+class CancelToken:
+    """
+    Stops a long run early, either when it's cancelled (e.g. from another thread or a signal handler) or when its
+    deadline passes
+    """
+
+    def __init__(self, timeout=None):
+        """
+        :param timeout: the number of seconds until the run should stop, None for no deadline
+        """
+        self.deadline = time.time() + timeout if timeout is not None else None
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def stopped(self):
+        return self.cancelled or (self.deadline is not None and time.time() >= self.deadline)
+
+
+class Progress:
+    """
+    The progress of a run over the recipes. The callback is called with this object after every processed
+    recipe (or shard of recipes), and the run checks the token before each one, so it stops early when the
+    token is stopped
+    """
+
+    def __init__(self, callback=None, token=None, total=None):
+        """
+        :param callback: a function of a Progress object, called whenever recipes are processed
+        :param token: a CancelToken of the run
+        :param total: the number of recipes in the run, if it is known
+        """
+        self.callback = callback
+        self.token = token
+        self.total = total
+        self.done = 0
+        self.stopped = False
+        self.start_time = time.time()
+
+    def begin(self, total=None):
+        """
+        Start (or restart) counting, once the recipes of the run are known
+        :param total: the number of recipes in the run, None if it isn't known
+        """
+        self.total = total
+        self.done = 0
+        self.start_time = time.time()
+        if self.callback is not None:
+            self.callback(self)
+
+    def update(self, n=1):
+        """
+        :param n: the number of recipes that were just processed
+        """
+        self.done += n
+        if self.callback is not None:
+            self.callback(self)
+
+    def should_stop(self):
+        """
+        :return: True if the run should stop, in which case the progress is marked as stopped
+        """
+        if self.token is not None and self.token.stopped():
+            self.stopped = True
+        return self.stopped
+
+    def elapsed(self):
+        return time.time() - self.start_time
+
+    def rate(self):
+        """
+        :return: the number of recipes processed per second
+        """
+        elapsed = self.elapsed()
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def eta(self):
+        """
+        :return: the estimated number of seconds until the run is done, None if it can't be estimated
+        """
+        rate = self.rate()
+        if self.total is None or rate == 0:
+            return None
+        return max(self.total - self.done, 0) / rate
@@ -0,0 +1,247 @@
+import json
+from pathlib import Path
+
+from preprocess import round_nicely, metric_scale
+from recipe_ir import DeviceEvent, parse_recipe_ir
+
+
+graph_attrs = {'fontsize': '12', 'fontname': 'calibri'}
+node_attrs = {'fontsize': '11', 'fontname': 'calibri bold', 'fixedsize': 'false', 'margin': '0.01'}
+edge_attrs = {'fontsize': '11', 'fontname': 'calibri'}
+
+
+class RecipeGraph:
+    """
+    A lightweight in-memory model of a recipe graph. The nodes are indexed by their labels, and each edge is
+    either at the top level of the graph or in one of its clusters (the steps of the recipe). The model can be
+    serialized to JSON or DOT text, or converted to a graphviz Digraph for rendering
+    """
+
+    def __init__(self, name=''):
+        self.name = name
+        self.nodes = []        # the label of each node id
+        self.node_ids = {}     # label -> node id
+        self.clusters = []     # a (<name>, <attributes dictionary>) tuple for each cluster id
+        self.cluster_ids = {}  # name -> cluster id
+        self.edges = []        # a (<source id>, <target id>, <label>, <cluster id or None>) tuple for each edge
+
+    def node(self, label):
+        """
+        :return: the id of the node with the given label, added to the graph if it's new
+        """
+        nid = self.node_ids.get(label)
+        if nid is None:
+            nid = len(self.nodes)
+            self.nodes.append(label)
+            self.node_ids[label] = nid
+        return nid
+
+    def cluster(self, name, **attrs):
+        """
+        :return: the id of the cluster with the given name, added to the graph if it's new. The given
+                 attributes are added to the cluster's attributes
+        """
+        cid = self.cluster_ids.get(name)
+        if cid is None:
+            cid = len(self.clusters)
+            self.clusters.append((name, {}))
+            self.cluster_ids[name] = cid
+        self.clusters[cid][1].update(attrs)
+        return cid
+
+    def edge(self, source, target, label=None, cluster=None):
+        """
+        Add an edge between the nodes with the given labels
+        :param cluster: the id of the cluster the edge is in, None for the top level of the graph
+        """
+        self.edges.append((self.node(source), self.node(target), label, cluster))
+
+    def to_dict(self):
+        return {'name': self.name, 'nodes': self.nodes,
+                'clusters': [{'name': name, 'attrs': attrs} for name, attrs in self.clusters],
+                'edges': [list(e) for e in self.edges]}
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
+
+    def to_dot(self):
+        """
+        :return: the DOT text of the graph, as graphviz would render it
+        """
+        lines = ['digraph {', '\t' + dot_attrs(graph_attrs), '\tnode [' + dot_attrs(node_attrs) + ']',
+                 '\tedge [' + dot_attrs(edge_attrs) + ']']
+        lines += ['\t' + self._dot_edge(e) for e in self.edges if e[3] is None]
+        for cid, (name, attrs) in enumerate(self.clusters):
+            lines.append('\tsubgraph ' + dot_quote(name) + ' {')
+            lines += ['\t\t' + self._dot_edge(e) for e in self.edges if e[3] == cid]
+            if len(attrs) > 0:
+                lines.append('\t\t' + dot_attrs(attrs))
+            lines.append('\t}')
+        lines.append('}')
+        return '\n'.join(lines) + '\n'
+
+    def _dot_edge(self, e):
+        edge = dot_quote(self.nodes[e[0]]) + ' -> ' + dot_quote(self.nodes[e[1]])
+        if e[2] is not None:
+            edge += ' [label=' + dot_quote(e[2]) + ']'
+        return edge
+
+    def to_digraph(self):
+        """
+        :return: a graphviz Digraph of the graph
+        """
+        from graphviz import Digraph  # only needed for rendering
+
+        graph = Digraph()
+        graph.attr(**graph_attrs)
+        graph.attr('node', **node_attrs)
+        graph.attr('edge', **edge_attrs)
+        for src, dst, label, cid in self.edges:
+            if cid is None:
+                graph.edge(self.nodes[src], self.nodes[dst], label=label)
+        for cid, (name, attrs) in enumerate(self.clusters):
+            with graph.subgraph(name=name) as sg:
+                for src, dst, label, c in self.edges:
+                    if c == cid:
+                        sg.edge(self.nodes[src], self.nodes[dst], label=label)
+                if len(attrs) > 0:
+                    sg.attr(**attrs)
+        return graph
+
+
+def dot_quote(text):
+    return '"' + str(text).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+
+
+def dot_attrs(attrs):
+    return ' '.join(k + '=' + dot_quote(v) for k, v in attrs.items())
+
+
+def node_name(ing, quantity, measure):
+    quantity = str(quantity) if len(str(quantity)) == 0 or float(quantity) > 0 else ''
+    if len(quantity) + len(measure) > 0:
+        return ing + '\n' + str(quantity) + ' ' + measure
+    return ing
+
+
+def break_step(direction):
+    steps = direction.split()
+    new_direction = ''
+    for i, word in enumerate(steps):
+        new_direction += word + ' '
+        if (i+1)%6 == 0 and len(steps) > i+2:
+            new_direction += '\n'
+    return new_direction
+
+
+def build_single_graphs(parsed, servings):
+    """
+    Build the graph models of a single parsed recipe
+    :param parsed: a ParsedRecipe object
+    :param servings: the number of servings, as shown in the graph
+    :return: the simple and the detailed RecipeGraphs
+    """
+    simple = RecipeGraph(parsed.title + '_Simple Graph')
+    detailed = RecipeGraph(parsed.title + '_Detailed Graph')
+
+    # create pre-action cluster
+    pre = detailed.cluster('cluster pre-actions')
+    for line in parsed.ingredients:
+        if len(line.preactions) > 0:
+            node = node_name(line.name, str(round_nicely(line.quantity)), line.unit)
+            simple.edge(node, node, label=', '.join(line.preactions))
+            detailed.edge(node, node, label=', '.join(line.preactions), cluster=pre)
+    detailed.cluster('cluster pre-actions', label='pre-actions', style='dashed')
+
+    for i, group in enumerate(parsed.groups):
+        cid = detailed.cluster('cluster' + str(group.step))
+        connection = parsed.title + '\n' + str(servings) + ' servings' if i == len(parsed.groups) - 1 else str(i)
+
+        for event in group.events:
+            if isinstance(event, DeviceEvent):
+                node = node_name(event.device, '', '')
+                verb = event.action
+            else:
+                line = parsed.ingredients[event.ingredient]
+                node = node_name(line.name, str(round_nicely(line.quantity)), line.unit)
+                verb = event.verb
+            simple.edge(node, connection, label=verb)
+            detailed.edge(node, connection, label=verb, cluster=cid)
+
+        detailed.cluster('cluster' + str(group.step), label=break_step(parsed.directions[group.step]),
+                         style='rounded')
+        if i > 0:  # add edges between a step and its preceding
+            simple.edge(str(i-1), connection)
+            detailed.edge(str(i-1), connection, cluster=cid)
+    return simple, detailed
+
+
+def build_averaged_graph(merged, recipe_name):
+    """
+    Build the graph model of merged recipes
+    :param merged: the merged recipes, as returned by merge_utils.merge_baseline
+    :param recipe_name: name of the requested recipes
+    :return: a RecipeGraph object
+    """
+    quantities, units, preactions, extracted, num_servings = merged
+    graph = RecipeGraph(recipe_name + '_Combined')
+
+    # index the quantity of each ingredient once, the last step an ingredient appears in is used
+    quant_index = {}
+    for i, (_, step_components) in enumerate(extracted):
+        seen = set()
+        for j, (ing, _) in enumerate(step_components):
+            if ing not in seen:
+                seen.add(ing)
+                quant_index[ing] = (i, j)
+
+    # create pre-action cluster
+    pre = graph.cluster('cluster pre-actions')
+    for actions in preactions:
+        if len(actions) > 0:
+            verb = [action for _, action in actions]
+            quantity, measure = '', ''
+            if actions[0][0] in quant_index:
+                i, j = quant_index[actions[0][0]]
+                quantity, measure = metric_scale(str(round_nicely(quantities[i][j] * num_servings)), units[i][j])
+            node = node_name(actions[0][0], quantity, measure)
+            graph.edge(node, node, label=', '.join(verb), cluster=pre)
+    graph.cluster('cluster pre-actions', label='pre-actions', style='dashed')
+
+    for i, (step_num, step_components) in enumerate(extracted):
+        cid = graph.cluster('cluster' + str(step_num))
+        connection = recipe_name + '\n' + str(int(num_servings)) + ' servings' if i == len(extracted) - 1 else str(i)
+
+        for j, (ing, verb) in enumerate(step_components):
+            quantity, measure = metric_scale(round_nicely(quantities[i][j]*num_servings), units[i][j])
+            node = node_name(ing, quantity, measure)
+            graph.edge(node, connection, label=verb, cluster=cid)
+            graph.cluster('cluster' + str(step_num), style='rounded')
+
+        if i > 0:  # add edges between a step and its preceding
+            graph.edge(str(i - 1), connection, cluster=cid)
+    return graph
+
+
+def export_graphs(recipes, out_dir, fmt='json', cache=None, lexicon=None):
+    """
+    Export the detailed graphs of many recipes, without rendering them
+    :param recipes: an iterable of normalized recipes (e.g. RecipeMetadata.iter_recipes())
+    :param out_dir: the directory the graphs are written to
+    :param fmt: 'json' or 'dot'
+    :param cache: an IRCache of the parsed recipes, if the parsing should be cached
+    :param lexicon: the Lexicon of the lite NLP backend (see lexicon.py), None for the full backend
+    :return: the number of exported graphs
+    """
+    out_dir = Path(out_dir)
+    if not out_dir.exists():
+        out_dir.mkdir(parents=True)
+    count = 0
+    for recipe in recipes:
+        parsed = parse_recipe_ir(recipe, lexicon=lexicon) if cache is None else cache.parse(recipe, lexicon=lexicon)
+        _, detailed = build_single_graphs(parsed, recipe['NumServings'])
+        text = detailed.to_json() if fmt == 'json' else detailed.to_dot()
+        with open(out_dir / (detailed.name + '.' + fmt), 'w') as f:
+            f.write(text)
+        count += 1
+    return count
@@ -0,0 +1,230 @@
+import os
+import hashlib
+import json
+import threading
+from pathlib import Path
+
+import msgpack
+
+from preprocess import split_ingredients, recipe_score
+from lexicon import nlp_backend
+from metadata import index_dir
+
+
+ir_cache_dir = 'parsed'  # the directory of the IRCache, in the index directory
+
+
+class IngredientLine:
+    """
+    An ingredient of the recipe, as listed in its ingredients list
+    """
+    __slots__ = ('name', 'quantity', 'unit', 'preactions')
+
+    def __init__(self, name, quantity, unit, preactions):
+        self.name = name                      # the ingredient's name, without its quantity and preparation
+        self.quantity = quantity              # the (float) quantity, for the whole recipe
+        self.unit = unit                      # the unit of measurement of the quantity
+        self.preactions = tuple(preactions)   # the verbs of the ingredient's preparation, e.g. ('melt',)
+
+
+class StepEvent:
+    """
+    An ingredient that is used in a step of the directions
+    """
+    __slots__ = ('name', 'verb', 'ingredient')
+
+    def __init__(self, name, verb, ingredient):
+        self.name = name              # the ingredient's name, as it was found in the direction
+        self.verb = verb              # the action done with the ingredient
+        self.ingredient = ingredient  # the index of the ingredient in the ingredients list
+
+
+class DeviceEvent:
+    """
+    A cooking device that is used in a step of the directions
+    """
+    __slots__ = ('device', 'action', 'time', 'temp')
+
+    def __init__(self, device, action, time=None, temp=None):
+        self.device = device  # the cooking device, e.g. 'oven'
+        self.action = action  # the full action, e.g. 'bake at 180 C for 35 minutes'
+        if time is None or temp is None:
+            time, temp = parse_device_action(action)
+        self.time = time      # the cooking time in minutes, 0 if it wasn't given
+        self.temp = temp      # the temperature in Celsius, None if it wasn't given
+
+
+class StepGroup:
+    """
+    All of the ingredients and cooking devices used in a single step of the directions
+    """
+    __slots__ = ('step', 'events')
+
+    def __init__(self, step, events):
+        self.step = step      # the index of the direction
+        self.events = events  # a list of StepEvents and DeviceEvents, in the order they are used
+
+
+class ParsedRecipe:
+    """
+    The intermediate representation of a parsed recipe, used for the merging and the graphs
+    """
+    __slots__ = ('title', 'servings', 'score', 'ingredients', 'groups', 'directions')
+
+    def __init__(self, title, servings, score, ingredients, groups, directions):
+        self.title = title
+        self.servings = servings
+        self.score = score
+        self.ingredients = ingredients  # a list of IngredientLines
+        self.groups = groups            # a list of StepGroups, ordered by their steps
+        self.directions = directions    # the (atomic) directions of the recipe
+
+    def to_bytes(self):
+        """
+        :return: a compact binary (msgpack) serialization of the recipe
+        """
+        ings = [[i.name, i.quantity, i.unit, list(i.preactions)] for i in self.ingredients]
+        groups = [[g.step, [[0, e.name, e.verb, e.ingredient] if isinstance(e, StepEvent) else
+                            [1, e.device, e.action, e.time, e.temp] for e in g.events]] for g in self.groups]
+        return msgpack.packb([self.title, self.servings, self.score, ings, groups, self.directions],
+                             use_bin_type=True)
+
+    @staticmethod
+    def from_bytes(data):
+        title, servings, score, ings, groups, directions = msgpack.unpackb(data, raw=False)
+        ings = [IngredientLine(*i) for i in ings]
+        groups = [StepGroup(step, [StepEvent(*e[1:]) if e[0] == 0 else DeviceEvent(*e[1:]) for e in events])
+                  for step, events in groups]
+        return ParsedRecipe(title, servings, score, ings, groups, directions)
+
+    def __reduce__(self):  # pickle (e.g. for multiprocessing) through the compact serialization
+        return ParsedRecipe.from_bytes, (self.to_bytes(),)
+
+
+def parse_device_action(action):
+    """
+    Extract the numeric time and temperature of a cooking device's action, as returned by
+    directions2pairs.find_cooking_devices (e.g. 'bake at 180 C for 35 minutes')
+    :return: a tuple of the time in minutes (0 if it wasn't given) and the temperature (None if it wasn't given)
+    """
+    words = action.split()
+    numbers = [a for a in words if a.isnumeric()]
+    if action.startswith('bake'):  # the first number of a baking action is its temperature
+        temp = int(numbers[0]) if len(numbers) > 0 else None
+        numbers = numbers[1:]
+    else:
+        temp = None
+    if len(numbers) == 0:
+        time = 0
+    else:
+        time = int(numbers[0]) if words[-1] == 'minutes' else 60*int(numbers[0])
+    return time, temp
+
+
+def score_recipe(recipe):
+    """
+    :return: the score of a recipe dictionary (see preprocess.recipe_score)
+    """
+    return recipe_score(float(recipe['Rating']), float(recipe['NumReviews']), float(recipe['NumMadeIt']))
+
+
+def parse_recipe_ir(recipe, score=None, lexicon=None, prefilter=None):
+    """
+    Parse a single recipe into its intermediate representation
+    :param recipe: a dictionary containing all of the necessary details about the recipe in question
+    :param score: the recipe's score, if it was already computed
+    :param lexicon: the Lexicon of the lite NLP backend (see lexicon.py), None for the full backend
+    :param prefilter: if given, a Counter of the ingredient-direction pairs that were correlated and pruned,
+            which is updated (see directions2pairs.find_correlations)
+    :return: a ParsedRecipe object
+    """
+    from directions2pairs import ingredient_prep, find_verb_tuples  # loads the NLP models, only needed here
+
+    if score is None:
+        score = score_recipe(recipe)
+    directions = recipe['Directions']
+
+    # strip ingredient names from quantities and measurement units
+    ings_table = split_ingredients(recipe['Ingredients'])
+    true_ings, prep = ingredient_prep([x[0] for x in ings_table], lexicon)
+    ingredient_tups, ind = find_verb_tuples(directions, true_ings, prefilter)
+
+    ingredients = [IngredientLine(name, float(q), m, [act[1] for act in p])
+                   for name, (_, q, m), p in zip(true_ings, ings_table, prep)]
+    groups = []
+    for (step, tups), inds in zip(ingredient_tups, ind):
+        events = [StepEvent(name, verb, int(i)) if i != -1 else DeviceEvent(name, verb)
+                  for (name, verb), i in zip(tups, inds)]
+        groups.append(StepGroup(int(step), events))
+    return ParsedRecipe(recipe['Title'], float(recipe['NumServings']), float(score), ingredients, groups,
+                        list(directions))
+
+
+class IRCache:
+    """
+    A directory of parsed recipes, so each recipe is parsed only once. The recipes are keyed by a hash of their
+    title, ingredients, directions and number of servings (and the NLP backend, if it isn't the full one), so a
+    changed recipe is parsed again. The score isn't part of the key, it's recomputed whenever a recipe is read
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(recipe, lexicon=None):
+        """
+        :param lexicon: the Lexicon of the lite NLP backend the recipe is parsed with, None for the full backend
+        """
+        content = [recipe['Title'], recipe['Ingredients'], recipe['Directions'], float(recipe['NumServings'])]
+        if nlp_backend(lexicon) != 'full':
+            content.append(nlp_backend(lexicon))
+        content = json.dumps(content)
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    def get(self, recipe, lexicon=None):
+        """
+        :return: the cached ParsedRecipe of the recipe, or None if it wasn't parsed yet
+        """
+        path = self.directory / (self.key(recipe, lexicon) + '.ir')
+        if not path.exists():
+            return None
+        with open(path, 'rb') as f:
+            return ParsedRecipe.from_bytes(f.read())
+
+    def discard(self, key):
+        """
+        Remove the parsed recipe with the given key (see IRCache.key) from the cache, if it's there
+        """
+        path = self.directory / (key + '.ir')
+        if path.exists():
+            path.unlink()
+
+    def put(self, recipe, parsed, lexicon=None):
+        # write to a temporary file first, so a concurrent reader never sees a partly written recipe
+        path = self.directory / (self.key(recipe, lexicon) + '.ir')
+        tmp = path.with_name(path.name + '.' + str(os.getpid()) + '.' + str(threading.get_ident()))
+        with open(tmp, 'wb') as f:
+            f.write(parsed.to_bytes())
+        os.replace(tmp, path)
+
+    def parse(self, recipe, score=None, lexicon=None, prefilter=None):
+        """
+        The arguments are the same as in parse_recipe_ir
+        :return: the ParsedRecipe of the recipe, from the cache if it's there
+        """
+        parsed = self.get(recipe, lexicon)
+        if parsed is None:
+            parsed = parse_recipe_ir(recipe, score, lexicon, prefilter)
+            self.put(recipe, parsed, lexicon)
+        else:  # the ratings might have changed since the recipe was cached
+            parsed.score = float(score if score is not None else score_recipe(recipe))
+        return parsed
+
+
+def load_ir_cache(json_path):
+    """
+    :param json_path: the directory where the downloaded recipes are found
+    :return: the IRCache of the recipes, in their index directory
+    """
+    return IRCache(index_dir(json_path) / ir_cache_dir)
@@ -1,12 +1,22 @@
 import os
-from preprocess import get_recipes
+import signal
+from tqdm import tqdm
+from metadata import load_metadata
+from ingest import ingest, report
+from title_index import load_title_index
+from context import load_context
 from draw_recipe import prepare_single_graph, prepare_averaged_graph, read_graph_file
+from progress import CancelToken, Progress
+from merge_utils import report_selection
 from pathlib import Path
 import matplotlib.pyplot as plt
 
 
-def draw_single_recipe(recipes_dict):
-    rec_names = list(recipes_dict.keys())
+max_combined = 200  # the maximal number of (top scored) recipes combined, so broad names don't take too long
+
+
+def draw_single_recipe(recipes_table, ctx):
+    rec_names = list(recipes_table.titles)
     print('found recipes:')
     for i, rname in enumerate(rec_names):
         print(str(i+1) + ') ' + rname)
@@ -14,31 +24,79 @@ def draw_single_recipe(recipes_dict):
     while chosen_ind < 1 or chosen_ind > len(rec_names):
         chosen_ind = int(input("Enter a recipe number: "))
 
-    chosen_rec = recipes_dict[rec_names[chosen_ind-1]]
-    simple, detailed = prepare_single_graph(chosen_rec)
+    chosen_rec = recipes_table.load_recipe(chosen_ind-1)
+    simple, detailed = prepare_single_graph(chosen_rec, ctx=ctx)
     detailed.view()
 
 
-def recipe_union(recipes_dict, recipe_name, to_wordcloud):
-    print('Combining (might take a while)... ')
-    graph = prepare_averaged_graph(recipes_dict, recipe_name, vis=to_wordcloud)
+def recipe_union(recipes_table, recipe_name, to_wordcloud, ctx):
+    print('Combining (press Ctrl+C to stop early and combine the recipes read so far)... ')
+    token = CancelToken()
+    bar = tqdm(unit='recipe')
+
+    def show_progress(progress):
+        bar.total = progress.total
+        bar.n = progress.done
+        bar.refresh()
+
+    handler = signal.signal(signal.SIGINT, lambda *_: token.cancel())
+    try:
+        progress = Progress(show_progress, token)
+        stats = {}
+        graph = prepare_averaged_graph(recipes_table, recipe_name, vis=to_wordcloud, progress=progress,
+                                       max_recipes=max_combined, ctx=ctx, stats=stats)
+    finally:
+        signal.signal(signal.SIGINT, handler)
+        bar.close()
+    selection = report_selection(stats)
+    if selection:
+        print(selection)
+    if progress.stopped:
+        print('Stopped early, combined ' + str(progress.done) + ' of ' + str(progress.total) + ' recipes.')
     graph.view()
 
 
+def suggest_recipe(json_path, recipe_name):
+    """
+    Suggest recipe titles similar to a name that had no matches
+    :return: the chosen title, or None if no suggestion was chosen
+    """
+    suggestions = load_title_index(json_path).search(recipe_name)
+    if not suggestions:
+        return None
+    print('Did you mean:')
+    for i, (title, _, _) in enumerate(suggestions):
+        print(str(i+1) + ') ' + title)
+    user_choice = input('Enter a recipe number, or press Enter to try another type of cake:   ')
+    if user_choice.isdigit() and 1 <= int(user_choice) <= len(suggestions):
+        return suggestions[int(user_choice)-1][0]
+    return None
+
+
 def input_recipe():
     recipe_name = input("Hi there. What cake would you like to make today?   ")
     json_path = Path(os.path.dirname(os.path.realpath(__file__)) +  '/jsons/')
-    recipes = get_recipes(json_path, recipe_name)
+    stats = ingest(json_path)  # bring the table up to date with the recipe files, quick when nothing changed
+    if stats['added'] + stats['changed'] + stats['deleted'] > 0:
+        print(report(stats))
+    meta = load_metadata(json_path)
+    recipes = meta.match(recipe_name)
+    if len(recipes) == 0:
+        suggestion = suggest_recipe(json_path, recipe_name)
+        if suggestion is not None:
+            recipe_name = suggestion
+            recipes = meta.match(recipe_name)
     return recipes, recipe_name
 
 
 def main():
     recipes, recipe_name = input_recipe()
-    while not recipes:
+    while len(recipes) == 0:
         print("No matches were found. Please try another type of cake.")
         recipes, recipe_name = input_recipe()
 
     print('Found ' + str(len(recipes)) + ' recipes.')
+    ctx = load_context(recipes.json_path)
     to_combine = None
     while to_combine is None:
         user_choice = input('Would you like a Specific recipe or a Combination [S/C]?   ').lower()
@@ -48,7 +106,7 @@ def main():
             to_combine = True
 
     if not to_combine:
-        draw_single_recipe(recipes)
+        draw_single_recipe(recipes, ctx)
         return
 
     to_wordcloud = None
@@ -59,7 +117,7 @@ def main():
         elif user_choice in ['y', 'yes']:
             to_wordcloud = True
 
-    recipe_union(recipes, recipe_name, to_wordcloud)
+    recipe_union(recipes, recipe_name, to_wordcloud, ctx)
     if to_wordcloud:
         plt.show()
 
@@ -0,0 +1,64 @@
+import os
+import sys
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from merge_utils import MIngredient, PartialMerge, reduce_partials
+
+
+def random_recipes(rng, num_recipes):
+    """
+    :return: a list of (<number of servings>, <score>, <ingredients>) tuples of random recipes, whose ingredient
+             names are often within the merging edit distance of each other (e.g. 'abcd', 'abcdef', 'abcdefgh')
+    """
+    names = ['abcd', 'abcdef', 'abcdefgh', 'flour', 'flours', 'floor', 'sugar', 'sugars', 'egg', 'eggs', 'oven',
+             'butter', 'buttermilk', 'milk', 'silk']
+    verbs = ['mix', 'beat', 'melt', 'stir', 'bake at 180 C for 30 minutes', 'bake at 200 C for 45 minutes']
+    units = ['cup', 'tablespoon', 'teaspoon', '']
+    recipes = []
+    for _ in range(num_recipes):
+        score = rng.choice([0.5, 1, 2.5, 4])
+        ings = [MIngredient(rng.choice(names), rng.randint(1, 8) / 2, rng.choice(units), rng.choice(verbs),
+                            [rng.choice(['', 'melted', 'sifted'])], rng.randint(0, 5), score)
+                for _ in range(rng.randint(1, 6))]
+        recipes.append((rng.randint(1, 12), score, ings))
+    return recipes
+
+
+def summary(state):
+    ns, scores, avg_ings, ings = state.result()
+    return ns, list(scores), avg_ings, [(ing.name, ing.get_verb(), ing.get_preaction(), ing.get_unit(),
+                                         ing.get_amount(), ing.get_step(), MIngredient.score_key(ing)) for ing in ings]
+
+
+def test_sharded_equals_serial():
+    for seed in range(200):
+        serial = PartialMerge()
+        for recipe in random_recipes(random.Random(seed), 30):
+            serial.add_recipe(*recipe)
+
+        # the same recipes, split into random consecutive shards which go through their serialized form
+        recipes = random_recipes(random.Random(seed), 30)
+        rng = random.Random(seed + 1000)
+        cuts = sorted(rng.sample(range(1, len(recipes)), rng.randint(1, 5)))
+        partials = []
+        for start, end in zip([0] + cuts, cuts + [len(recipes)]):
+            shard = PartialMerge(deferred=True)
+            for recipe in recipes[start:end]:
+                shard.add_recipe(*recipe)
+            partials.append(shard.to_dict())
+        assert summary(reduce_partials(partials)) == summary(serial)
+
+
+def test_edit_distance_chain():
+    # merging by edit distance isn't transitive, so the shards must be merged recipe by recipe
+    recipes = [[MIngredient(name, 1, 'cup', 'mix', [''], 0, 1.0)] for name in ['abcd', 'abcdef', 'abcdefgh']]
+    serial = PartialMerge()
+    for ings in recipes:
+        serial.add_recipe(1, 1.0, ings)
+    first, second = PartialMerge(deferred=True), PartialMerge(deferred=True)
+    first.add_recipe(1, 1.0, [MIngredient('abcd', 1, 'cup', 'mix', [''], 0, 1.0)])
+    second.add_recipe(1, 1.0, [MIngredient('abcdef', 1, 'cup', 'mix', [''], 0, 1.0)])
+    second.add_recipe(1, 1.0, [MIngredient('abcdefgh', 1, 'cup', 'mix', [''], 0, 1.0)])
+    assert [ing.name for ing in reduce_partials([first, second]).ings] == [ing.name for ing in serial.ings]
@@ -0,0 +1,35 @@
+import os
+import sys
+import random
+
+# the vocabulary of directions2pairs is loaded relative to the repository's root
+root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, root)
+os.chdir(root)
+
+from collections import Counter
+from directions2pairs import vocab, cross_correlate, find_correlations, pruning_rate
+
+
+def reference_correlations(ing, directions):
+    """
+    The correlations without the trigram prefilter, which find_correlations should match
+    """
+    return vocab.score_matches([cross_correlate(d, ing) for d in directions])
+
+
+def random_text(rng, words, max_words):
+    return ' '.join(rng.choice(words) for _ in range(rng.randint(1, max_words)))
+
+
+def test_matches_reference():
+    rng = random.Random(7)
+    words = ['flour', 'sugar', 'butter', 'eggs', 'milk', 'salt', 'baking', 'powder', 'vanilla', 'extract', 'mix',
+             'the', 'and', 'in', 'a', 'bowl', 'bake', 'oven', 'at', '350', 'degrees', 'until', 'golden', 'xq', 'zz',
+             'cream', 'cheese', 'beat', 'stir', 'pour', 'into', 'pan', 'cool', 'fold', 'whites', 'ab', 'ba']
+    stats = Counter()
+    for _ in range(5000):
+        ing = random_text(rng, words, 3)
+        directions = [random_text(rng, words, 8) for _ in range(rng.randint(1, 4))]
+        assert find_correlations(ing, directions, stats) == reference_correlations(ing, directions)
+    assert 0 < pruning_rate(stats) < 1
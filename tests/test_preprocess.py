@@ -0,0 +1,72 @@
+import os
+import re
+import sys
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from preprocess import round_nicely, parse_quantities, ingredients_quantities_to_decimal, normalize_recipe, \
+    normalize_batch
+
+
+def reference_quantities_to_decimal(ing_list, num_dishes=1):
+    """
+    The per-word parser parse_quantities replaced, which its results should match (without unicode fractions)
+    """
+    new_ing_list = []
+    for ing in ing_list:
+        quant = 0
+        counter = 0
+        for n in ing.split():
+            res = re.findall('^[0-9]+/[0-9]+', n)  # find fracs
+            for r in res:
+                counter += 1
+                slash = r.find('/')
+                quant += int(r[:slash]) / int(r[slash+1:])
+            if res:
+                continue
+            res = re.findall(r'^[0-9]*\.[0-9]+|^[0-9]+', n)  # find ints and decimals
+            for r in res:
+                counter += 1
+                quant += float(r)
+        new_ing_list.append(str(round_nicely(quant/int(num_dishes))) + ' ' + ' '.join(ing.split()[counter:]))
+    return new_ing_list
+
+
+def random_line(rng):
+    words = ['1', '2', '10', '1/2', '3/4', '1.5', '.5', '2.', '0', '1/2/3', '12/', '2-3', '1-1/2', 'cup', 'cups',
+             'flour,', 'sugar', '(8', 'oz)', '3x', 'a1', '1,000', '1e3', 'x/2', '07']
+    return rng.choice([' ', '  ', '\t']).join(rng.choice(words) for _ in range(rng.randint(0, 6)))
+
+
+def test_matches_reference():
+    rng = random.Random(3)
+    for _ in range(5000):
+        lines = [random_line(rng) for _ in range(rng.randint(1, 4))]
+        if any('/0' in line for line in lines):  # both divide by zero
+            continue
+        assert ingredients_quantities_to_decimal(lines) == reference_quantities_to_decimal(lines)
+
+
+def test_batch_matches_single_lines():
+    rng = random.Random(5)
+    lines = [line for line in (random_line(rng) for _ in range(2000)) if '/0' not in line]
+    quantities, rests = parse_quantities(lines)
+    for line, quantity, rest in zip(lines, quantities, rests):
+        single_quantity, single_rest = parse_quantities([line])
+        assert quantity == single_quantity[0] and rest == single_rest[0]
+
+
+def test_unicode_fractions():
+    quantities, rests = parse_quantities(['1 ½ cups flour', '1½ cup milk', '¾ teaspoon salt', '2 eggs', 'salt'])
+    assert quantities.tolist() == [1.5, 1.5, 0.75, 2, 0]
+    assert rests == ['cups flour', 'cup milk', 'teaspoon salt', 'eggs', 'salt']
+    assert parse_quantities([])[0].tolist() == []
+
+
+def test_normalize_batch():
+    recipes = [{'Title': 'a', 'Ingredients': ['1 1/2 cups flour (sifted)', '2 Eggs'], 'Directions': ['Mix. Bake.']},
+               {'Title': 'b', 'Ingredients': [], 'Directions': []},
+               {'Title': 'c', 'Ingredients': ['½ cup milk'], 'Directions': ['Pour.']}]
+    assert normalize_batch(recipes) == [normalize_recipe(recipe) for recipe in recipes]
+    assert recipes[0]['Ingredients'] == ['1 1/2 cups flour (sifted)', '2 Eggs']
@@ -0,0 +1,182 @@
+import re
+import pickle
+
+import numpy as np
+
+from metadata import index_dir, load_metadata
+
+
+title_index_file = 'titles.idx'
+
+
+def normalize_title(title):
+    """
+    Lowercase the title and reduce it to alphanumeric words separated by single spaces
+    """
+    return ' '.join(re.findall(r'[a-z0-9]+', title.lower()))
+
+
+def trigrams(text):
+    """
+    Split the (normalized) text into its character trigrams. The text is padded with spaces so short
+    words and word boundaries also produce trigrams
+    :param text: a normalized title or query
+    :return: a set of the trigrams in the text
+    """
+    padded = ' ' + text + ' '
+    return {padded[i:i+3] for i in range(len(padded) - 2)}
+
+
+class TitleIndex:
+    """
+    An inverted index from character trigrams to recipe titles, used for typo-tolerant title search
+    """
+
+    def __init__(self):
+        self.keys = []       # the key (recipe file name) of each title id, None if removed
+        self.titles = []     # the original title of each title id
+        self.norms = []      # the normalized title of each title id
+        self.scores = []     # the recipe score of each title id
+        self.num_grams = []  # the number of trigrams in each title
+        self.postings = {}   # trigram -> list of title ids
+        self.key_to_id = {}
+        self.max_score = 0
+        self._arrays = None  # cached numpy views of the index, rebuilt after changes
+
+    def __len__(self):
+        return len(self.key_to_id)
+
+    def add(self, key, title, score=0):
+        """
+        Add a title to the index. If the key is already indexed, the old title is replaced
+        :param key: a unique key of the recipe (its file name)
+        :param title: the title of the recipe
+        :param score: the recipe's score, as given by recipe_score
+        """
+        if key in self.key_to_id:
+            self.remove(key)
+        tid = len(self.keys)
+        norm = normalize_title(title)
+        grams = trigrams(norm)
+        self.keys.append(key)
+        self.titles.append(title)
+        self.norms.append(norm)
+        self.scores.append(score)
+        self.num_grams.append(len(grams))
+        for g in grams:
+            self.postings.setdefault(g, []).append(tid)
+        self.key_to_id[key] = tid
+        self.max_score = max(self.max_score, score)
+        self._arrays = None
+
+    def remove(self, key):
+        """
+        Remove the title with the given key from the index. The postings are cleaned lazily
+        """
+        tid = self.key_to_id.pop(key, None)
+        if tid is not None:
+            self.keys[tid] = None
+            self._arrays = None
+
+    def _get_arrays(self):
+        """
+        :return: numpy arrays of the postings, number of trigrams, scores and liveness of every title id
+        """
+        if self._arrays is None:
+            postings = {g: np.array(ids, dtype=np.int32) for g, ids in self.postings.items()}
+            num_grams = np.array(self.num_grams, dtype=np.float64)
+            scores = np.array(self.scores, dtype=np.float64)
+            alive = np.array([k is not None for k in self.keys], dtype=bool)
+            self._arrays = postings, num_grams, scores, alive
+        return self._arrays
+
+    def search(self, query, limit=10, min_sim=0.3, score_weight=0.1):
+        """
+        Find the titles most similar to the query
+        :param query: the (possibly misspelled) recipe name
+        :param limit: the maximal number of results
+        :param min_sim: the minimal trigram similarity of a returned title
+        :param score_weight: the weight of the (normalized) recipe score in the ranking
+        :return: a list of (<title>, <key>, <similarity>) tuples, best match first
+        """
+        norm = normalize_title(query)
+        if len(norm) == 0 or len(self) == 0:
+            return []
+        grams = trigrams(norm)
+        postings, num_grams, scores, alive = self._get_arrays()
+        lists = [postings[g] for g in grams if g in postings]
+        if not lists:
+            return []
+        hits = np.bincount(np.concatenate(lists), minlength=len(self.keys))
+        cands = np.nonzero(hits)[0]
+        cands = cands[alive[cands]]
+
+        sims = 2 * hits[cands] / (len(grams) + num_grams[cands])
+        # an exact substring match is always a perfect match. Only the titles that have all of the query's
+        # unpadded trigrams (e.g. not ' ca' of 'cake', so 'cheesecake' counts) can contain it
+        inner = {norm[i:i+3] for i in range(len(norm) - 2)}
+        if all(g in postings for g in inner):
+            possible = np.ones(len(cands), dtype=bool)
+            if inner:
+                inner_hits = np.bincount(np.concatenate([postings[g] for g in inner]), minlength=len(self.keys))
+                possible = inner_hits[cands] == len(inner)
+            exact = np.array([norm in self.norms[tid] for tid in cands[possible]], dtype=bool)
+            if len(exact) > 0:
+                sims[np.nonzero(possible)[0][exact]] = 1
+        keep = sims >= min_sim
+        cands, sims = cands[keep], sims[keep]
+
+        max_score = self.max_score if self.max_score > 0 else 1
+        rank = sims + score_weight * scores[cands] / max_score
+        order = np.argsort(-rank, kind='stable')[:limit]
+        return [(self.titles[cands[i]], self.keys[cands[i]], float(sims[i])) for i in order]
+
+    def compact(self):
+        """
+        Rebuild the index without the removed titles
+        """
+        entries = [(k, t, s) for k, t, s in zip(self.keys, self.titles, self.scores) if k is not None]
+        self.__init__()
+        for k, t, s in entries:
+            self.add(k, t, s)
+
+    def save(self, path):
+        if 4 * (len(self.keys) - len(self)) > len(self.keys):  # compact once a quarter of the ids were removed
+            self.compact()
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+
+def build_title_index(json_path):
+    """
+    Build a title index over all of the recipes in the given directory
+    :param json_path: the directory where the downloaded recipes are found
+    :return: a TitleIndex object
+    """
+    meta = load_metadata(json_path)
+    index = TitleIndex()
+    for key, title, score in zip(meta.files, meta.titles, meta.scores()):
+        index.add(str(key), str(title), float(score))
+    return index
+
+
+def load_title_index(json_path, rebuild=False):
+    """
+    Load the title index of the given recipes directory, building (and saving) it if it doesn't exist
+    :param json_path: the directory where the downloaded recipes are found
+    :param rebuild: True if the index should be rebuilt even if it exists
+    :return: a TitleIndex object
+    """
+    path = index_dir(json_path) / title_index_file
+    if path.exists() and not rebuild:
+        return TitleIndex.load(path)
+    index = build_title_index(json_path)
+    if not path.parent.exists():
+        path.parent.mkdir()
+    index.save(path)
+    return index
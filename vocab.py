@@ -0,0 +1,122 @@
+import json
+from pathlib import Path
+
+import numpy as np
+
+
+vocab_dir = 'vocab'  # the saved vocabulary, next to the tf-idf weights it's built from
+unknown_id = 0       # the id of every word that isn't in the vocabulary
+
+
+class Vocabulary:
+    """
+    The words of the tf-idf table, interned to integer ids. The tf-idf weight, the stop word flag and the
+    adjective flag of each word are kept in arrays indexed by its id, so a whole batch of words is scored by
+    gathering from the arrays. The arrays can be memory-mapped from the saved vocabulary
+    """
+
+    def __init__(self, words, weights, stop, adj, blacklist=()):
+        self.words = words                              # id -> word, words[unknown_id] is ''
+        self.word_ids = {w: i for i, w in enumerate(words)}
+        self.weights = weights                          # the tf-idf weight of each word, 0 if unknown
+        self.stop = stop                                # whether each word is a stop word
+        self.adj = adj                                  # whether each word is tagged as an adjective
+        self.lengths = np.array([len(w) for w in words])
+        self.blacklist = np.zeros(len(words), dtype=bool)  # words that never add their weight to a score
+        self.blacklist[[self.word_ids[w] for w in blacklist if w in self.word_ids]] = True
+
+    def __len__(self):
+        return len(self.words)
+
+    def ids(self, words):
+        """
+        :return: an array of the ids of the given words
+        """
+        return np.array([self.word_ids.get(w, unknown_id) for w in words], dtype=int)
+
+    def score_matches(self, corrs):
+        """
+        Score a batch of matches found by the cross correlation. Words that have no tf-idf weight or are 2
+        characters long at most are dropped from the matches. Each remaining word adds its tf-idf weight to
+        the score, unless it's an adjective or blacklisted, and a stop word takes its length off the score
+        :param corrs: a list of (<substring length>, <substring>) tuples
+        :return: a list of (<score>, <match>) tuples, one for each of the given matches
+        """
+        words = [c[1].split() for c in corrs]
+        owners = np.repeat(np.arange(len(corrs)), [len(w) for w in words])
+        ids = self.ids([w for ws in words for w in ws])
+        keep = (self.weights[ids] != 0) & (self.lengths[ids] > 2)
+        owners, ids = owners[keep], ids[keep]
+
+        gains = np.where(self.adj[ids] | self.blacklist[ids], 0, self.weights[ids])
+        gains = gains - self.stop[ids] * self.lengths[ids]
+        scores = np.array([c[0] for c in corrs], dtype=float) + np.bincount(owners, gains, minlength=len(corrs))
+
+        kept = [[] for _ in corrs]
+        for owner, i in zip(owners, ids):
+            kept[owner].append(self.words[i])
+        return [(score, ' '.join(match)) for score, match in zip(scores, kept)]
+
+    def save(self, directory):
+        directory = Path(directory)
+        if not directory.exists():
+            directory.mkdir(parents=True)
+        with open(directory / 'words.json', 'w') as f:
+            json.dump(self.words, f)
+        np.save(directory / 'weights.npy', self.weights)
+        np.save(directory / 'stop.npy', self.stop)
+        np.save(directory / 'adj.npy', self.adj)
+
+    @staticmethod
+    def load(directory, blacklist=(), mmap=False):
+        """
+        :param directory: the directory the vocabulary was saved in
+        :param blacklist: words that never add their weight to a score
+        :param mmap: whether to memory-map the arrays instead of reading them
+        :return: a Vocabulary object
+        """
+        directory = Path(directory)
+        mode = 'r' if mmap else None
+        with open(directory / 'words.json', 'r') as f:
+            words = json.load(f)
+        return Vocabulary(words, np.load(directory / 'weights.npy', mmap_mode=mode),
+                          np.load(directory / 'stop.npy', mmap_mode=mode),
+                          np.load(directory / 'adj.npy', mmap_mode=mode), blacklist)
+
+
+def build_vocabulary(tfidf_path, tagger, blacklist=()):
+    """
+    Intern the words of a tf-idf table, tagging each of them once
+    :param tfidf_path: the path of the tf-idf weights (a json dictionary of word -> weight)
+    :param tagger: the spacy model used to tag the words
+    :param blacklist: words that never add their weight to a score
+    :return: a Vocabulary object
+    """
+    with open(tfidf_path, 'r') as f:
+        tfidf = json.load(f)
+    words = [''] + sorted(w for w in tfidf if len(w) > 0)
+    weights = np.array([0.0] + [tfidf[w] for w in words[1:]])
+    tokens = [tagger(w)[0] for w in words[1:]]
+    stop = np.array([False] + [t.is_stop for t in tokens])
+    adj = np.array([False] + [t.pos_ == 'ADJ' for t in tokens])
+    return Vocabulary(words, weights, stop, adj, blacklist)
+
+
+def load_vocabulary(tfidf_path, tagger, blacklist=(), mmap=True, rebuild=False):
+    """
+    Load the saved vocabulary of the tf-idf weights, or build and save it if it wasn't built yet (or is older
+    than the weights)
+    :param tfidf_path: the path of the tf-idf weights
+    :param tagger: the spacy model used to tag the words, if the vocabulary is built
+    :param blacklist: words that never add their weight to a score
+    :param mmap: whether to memory-map the arrays of a saved vocabulary
+    :param rebuild: whether to rebuild the vocabulary even if it was saved
+    :return: a Vocabulary object
+    """
+    directory = Path(tfidf_path).parent / vocab_dir
+    words_path = directory / 'words.json'
+    if not rebuild and words_path.exists() and words_path.stat().st_mtime >= Path(tfidf_path).stat().st_mtime:
+        return Vocabulary.load(directory, blacklist, mmap)
+    vocab = build_vocabulary(tfidf_path, tagger, blacklist)
+    vocab.save(directory)
+    return vocab